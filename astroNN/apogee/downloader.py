@@ -344,7 +344,8 @@ def combined_spectra(dr=None, location=None, field=None, apogee=None, telescope=
     if (location is None and dr < 16) or (field is None and dr >= 16):  # try to load info if not enough info
         global _ALLSTAR_TEMP
         if not str(f'dr{dr}') in _ALLSTAR_TEMP:
-            _ALLSTAR_TEMP[f'dr{dr}'] = fits.getdata(allstar(dr=dr))
+            from astroNN.shared.catalog_cache import CatalogCache
+            _ALLSTAR_TEMP[f'dr{dr}'] = CatalogCache(allstar(dr=dr))
         if telescope is None:
             matched_idx = [np.nonzero(_ALLSTAR_TEMP[f'dr{dr}']['APOGEE_ID'] == apogee)[0]][0]
         else:
@@ -491,7 +492,8 @@ def visit_spectra(dr=None, location=None, field=None, apogee=None, telescope=Non
     if (location is None and dr < 16) or (field is None and dr >= 16):  # try to load info if not enough info
         global _ALLSTAR_TEMP
         if not str(f'dr{dr}') in _ALLSTAR_TEMP:
-            _ALLSTAR_TEMP[f'dr{dr}'] = fits.getdata(allstar(dr=dr))
+            from astroNN.shared.catalog_cache import CatalogCache
+            _ALLSTAR_TEMP[f'dr{dr}'] = CatalogCache(allstar(dr=dr))
         if telescope is None:
             matched_idx = [np.nonzero(_ALLSTAR_TEMP[f'dr{dr}']['APOGEE_ID'] == apogee)[0]][0]
         else:
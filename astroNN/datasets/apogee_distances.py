@@ -4,11 +4,11 @@
 
 import numpy as np
 from astropy import units as u
-from astropy.io import fits
 
 from astroNN.apogee import allstar
 from astroNN.apogee.downloader import apogee_distances
 from astroNN.gaia import mag_to_absmag, mag_to_fakemag, extinction_correction
+from astroNN.shared.catalog_cache import CatalogCache
 
 
 # noinspection PyUnresolvedReferences
@@ -36,20 +36,20 @@ def load_apogee_distances(dr=None, metric='distance', cuts=True, extinction=True
     """
     fullfilename = apogee_distances(dr=dr)
 
-    with fits.open(fullfilename) as F:
-        hdulist = F[1].data
-        # Convert kpc to pc
-        distance = hdulist['BPG_dist50'] * 1000
-        dist_err = (hdulist['BPG_dist84'] - hdulist['BPG_dist16']) * 1000
+    # only a few columns are needed, read them from astroNN catalog cache instead of parsing the whole FITS
+    distances_data = CatalogCache(fullfilename)
+    # Convert kpc to pc
+    distance = distances_data['BPG_dist50'] * 1000
+    dist_err = (distances_data['BPG_dist84'] - distances_data['BPG_dist16']) * 1000
 
     allstarfullpath = allstar(dr=dr)
 
-    with fits.open(allstarfullpath) as F:
-        k_mag = F[1].data['K']
-        if extinction:
-            k_mag = extinction_correction(k_mag, F[1].data['AK_TARG'])
-        ra = F[1].data['RA']
-        dec = F[1].data['DEC']
+    allstar_data = CatalogCache(allstarfullpath)
+    k_mag = np.array(allstar_data['K'])
+    if extinction:
+        k_mag = extinction_correction(k_mag, allstar_data['AK_TARG'])
+    ra = np.array(allstar_data['RA'])
+    dec = np.array(allstar_data['DEC'])
 
     # Bad index refers to nan index
     bad_index = np.argwhere(np.isnan(distance))
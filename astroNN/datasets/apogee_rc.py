@@ -2,12 +2,13 @@
 #   astroNN.datasets.apogee_rc: APOGEE RC
 # ---------------------------------------------------------#
 
+import numpy as np
 from astropy import units as u
-from astropy.io import fits
 
 from astroNN.apogee.downloader import apogee_vac_rc
 from astroNN.gaia import extinction_correction
 from astroNN.gaia.gaia_shared import mag_to_absmag, mag_to_fakemag
+from astroNN.shared.catalog_cache import CatalogCache
 
 
 # noinspection PyUnresolvedReferences
@@ -33,15 +34,15 @@ def load_apogee_rc(dr=None, metric='distance', extinction=True):
     """
     fullfilename = apogee_vac_rc(dr=dr)
 
-    with fits.open(fullfilename) as F:
-        hdulist = F[1].data
-        ra = hdulist['RA']
-        dec = hdulist['DEC']
-        rc_dist = hdulist['RC_DIST']
-        rc_parallax = (1 / rc_dist) * u.mas  # Convert kpc to parallax in mas
-        k_mag = hdulist['K']
-        if extinction:
-            k_mag = extinction_correction(k_mag, hdulist['AK_TARG'])
+    # only a few columns are needed, read them from astroNN catalog cache instead of parsing the whole FITS
+    rc_data = CatalogCache(fullfilename)
+    ra = np.array(rc_data['RA'])
+    dec = np.array(rc_data['DEC'])
+    rc_dist = np.array(rc_data['RC_DIST'])
+    rc_parallax = (1 / rc_dist) * u.mas  # Convert kpc to parallax in mas
+    k_mag = np.array(rc_data['K'])
+    if extinction:
+        k_mag = extinction_correction(k_mag, rc_data['AK_TARG'])
 
     if metric == 'distance':
         output = rc_dist * 1000
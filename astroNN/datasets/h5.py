@@ -2,9 +2,10 @@
 #   astroNN.datasets.h5: compile h5 files for NN
 # ---------------------------------------------------------#
 
+import multiprocessing
 import os
 import time
-from functools import reduce
+import zlib
 
 import h5py
 import numpy as np
@@ -15,14 +16,47 @@ import astroNN.data
 from astroNN.apogee import combined_spectra, visit_spectra, allstar
 from astroNN.apogee.apogee_shared import apogee_env, apogee_default_dr
 from astroNN.apogee.chips import gap_delete, apogee_continuum, chips_pix_info
+from astroNN.datasets.selection import Cut, StarSelection
 from astroNN.datasets.xmatch import xmatch
 from astroNN.gaia import mag_to_fakemag, extinction_correction
 from astroNN.gaia.downloader import gaiadr2_parallax, anderson_2017_parallax
 from astroNN.gaia.gaia_shared import gaia_env
+from astroNN.shared.catalog_cache import CatalogCache
+
+try:
+    import hdf5plugin  # registers blosc filter to h5py to read and write blosc compressed h5 files
+except ImportError:
+    hdf5plugin = None
 
 currentdir = os.getcwd()
 _APOGEE_DATA = apogee_env()
 _GAIA_DATA = gaia_env()
+_ALLOWED_INDEX_TEMP = {}
+
+
+# (h5 dataset name, allStar column, index of the allStar column or None for 1D column) of ASPCAP labels
+_ASPCAP_LABELS = [('teff', 'PARAM', 0), ('logg', 'PARAM', 1), ('M', 'PARAM', 3), ('alpha', 'PARAM', 6),
+                  ('C', 'X_H', 0), ('C1', 'X_H', 1), ('N', 'X_H', 2), ('O', 'X_H', 3), ('Na', 'X_H', 4),
+                  ('Mg', 'X_H', 5), ('Al', 'X_H', 6), ('Si', 'X_H', 7), ('P', 'X_H', 8), ('S', 'X_H', 9),
+                  ('K', 'X_H', 10), ('Ca', 'X_H', 11), ('Ti', 'X_H', 12), ('Ti2', 'X_H', 13), ('V', 'X_H', 14),
+                  ('Cr', 'X_H', 15), ('Mn', 'X_H', 16), ('Fe', 'X_H', 17), ('Co', 'X_H', 18), ('Ni', 'X_H', 19),
+                  ('Cu', 'X_H', 20), ('Ge', 'X_H', 21), ('Ce', 'X_H', 22), ('Rb', 'X_H', 23), ('Y', 'X_H', 24),
+                  ('Nd', 'X_H', 25)]
+_ASPCAP_LABELS_ERR = [('teff_err', 'TEFF_ERR', None), ('logg_err', 'LOGG_ERR', None), ('M_err', 'M_H_ERR', None),
+                      ('alpha_err', 'ALPHA_M_ERR', None)] + \
+                     [(f'{name}_err', 'X_H_ERR', column_idx) for name, column, column_idx in _ASPCAP_LABELS
+                      if column == 'X_H']
+# per-star datasets written by H5Compiler, every other non-derived dataset has one entry per spectrum
+_STAR_DATASETS = ['index', 'fingerprint']
+# (h5 dataset name, allStar column) of the other allStar information
+_ALLSTAR_INFO = [('RA', 'RA'), ('DEC', 'DEC'), ('Kmag', 'K'), ('AK_TARG', 'AK_TARG')]
+# datasets computed from the whole file at the end of H5Compiler.compile()
+_DERIVED_DATASETS = [name for name, column in _ALLSTAR_INFO] + \
+                    [name for name, column, column_idx in _ASPCAP_LABELS + _ASPCAP_LABELS_ERR] + \
+                    ['parallax', 'parallax_err', 'fakemag', 'fakemag_err', 'AK_TARG_err', 'labels', 'labels_err',
+                     'allowed_index']
+# settings which have to be the same to resume or update an existing h5 file
+_RESUME_SETTINGS = ['apogee_dr', 'continuum', 'spectra_only', 'use_err']
 
 
 def h5name_check(h5name):
@@ -47,6 +81,7 @@ class H5Compiler(object):
         self.SNR_low = 200  # Lower bound of SNR
         self.SNR_high = 99999  # Upper bound of SNR
         self.ironlow = -10000  # Lower bound of SNR
+        self.cuts = None  # List of astroNN.datasets.selection.Cut to select stars, None to use the cuts above
         self.filename = None  # Filename of the resulting .h5 file
         self.spectra_only = False  # True to include spectra only without any aspcap abundances
         self.cont_mask = None  # Continuum Mask, none to use default mask
@@ -57,51 +92,56 @@ class H5Compiler(object):
         self.use_anderson_2017 = False
         self.use_err = True  # Whether to include error information in h5 dataset
         self.continuum = True  # True to do continuum normalization, False to use aspcap normalized spectra
+        self.workers = 1  # Number of processes to read and normalize spectra, None to use all CPUs
+        self.batch_size = 1024  # Number of spectra kept in memory before writing to the h5 file
+        self.resume = False  # True to resume an interrupted compile or update an existing h5 file with new stars
+        self.compression = None  # Compression of spectra, None, 'lzf', 'gzip' or 'blosc' (requires hdf5plugin)
+        self.compression_opts = None  # Compression level for 'gzip' (0-9) or 'blosc' (0-9)
+        self.shuffle = False  # True to apply shuffle filter before compression, usually improve compression ratio
+        self.chunk_rows = None  # Number of spectra per chunk, ideally your training batch size, None for auto
+        self.spectra_dtype = 'float32'  # 'float32' or 'float16' to store spectra in half precision
+        self.label_matrix = False  # True to store labels in 2D 'labels' and 'labels_err' instead of a dataset each
+        self.shard_size = None  # Number of stars per shard file with a virtual dataset index file, None for one file
+        self._selection = None
+
+    def __getstate__(self):
+        # worker processes of compile() only need the settings, not the memoised selection of allStar
+        state = self.__dict__.copy()
+        state['_selection'] = None
+        return state
 
     def load_allstar(self):
         self.apogee_dr = apogee_default_dr(dr=self.apogee_dr)
         allstarpath = allstar(dr=self.apogee_dr)
-        hdulist = fits.open(allstarpath)
         print(f'Loading allStar DR{self.apogee_dr} catalog')
-        return hdulist
-
-    def filter_apogeeid_list(self, hdulist):
-        vscatter = hdulist[1].data['VSCATTER']
-        SNR = hdulist[1].data['SNR']
-        location_id = hdulist[1].data['LOCATION_ID']
-        teff = hdulist[1].data['PARAM'][:, 0]
-        Fe = hdulist[1].data['X_H'][:, 17]
+        return CatalogCache(allstarpath)
 
-        total = range(len(SNR))
+    def default_cuts(self):
+        """
+        Cuts from the selection attributes of H5Compiler (starflagcut, teff_low, SNR_low etc.)
 
+        :return: list of Cut
+        :rtype: list
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        cuts = [Cut('PARAM', '>=', self.teff_low, index=0), Cut('PARAM', '<=', self.teff_high, index=0),
+                Cut('VSCATTER', '<', self.vscattercut), Cut('X_H', '>', self.ironlow, index=17),
+                Cut('SNR', '>', self.SNR_low), Cut('SNR', '<', self.SNR_high), Cut('LOCATION_ID', '>', 1)]
         if self.starflagcut is True:
-            starflag = hdulist[1].data['STARFLAG']
-            fitlered_starflag = np.where(starflag == 0)[0]
-        else:
-            fitlered_starflag = total
-
+            cuts.append(Cut('STARFLAG', '==', 0))
         if self.aspcapflagcut is True:
-            aspcapflag = hdulist[1].data['ASPCAPFLAG']
-            fitlered_aspcapflag = np.where(aspcapflag == 0)[0]
-        else:
-            fitlered_aspcapflag = total
+            cuts.append(Cut('ASPCAPFLAG', '==', 0))
+        return cuts
 
-        fitlered_temp_lower = np.where((self.teff_low <= teff))[0]
-        fitlered_temp_upper = np.where((self.teff_high >= teff))[0]
-        fitlered_vscatter = np.where(vscatter < self.vscattercut)[0]
-        fitlered_Fe = np.where(Fe > self.ironlow)[0]
-        fitlered_snrlow = np.where(SNR > self.SNR_low)[0]
-        fitlered_snrhigh = np.where(SNR < self.SNR_high)[0]
-        fitlered_location = np.where(location_id > 1)[0]
-
-        filtered_index = reduce(np.intersect1d,
-                                (fitlered_starflag, fitlered_aspcapflag, fitlered_temp_lower, fitlered_vscatter,
-                                 fitlered_Fe, fitlered_snrlow, fitlered_snrhigh, fitlered_location,
-                                 fitlered_temp_upper))
+    def filter_apogeeid_list(self, allstar_data):
+        # selection is kept so masks of cuts are reused if the same allStar is filtered again
+        if self._selection is None or self._selection.catalog is not allstar_data:
+            self._selection = StarSelection(allstar_data)
+        filtered_index = self._selection.select(self.default_cuts() if self.cuts is None else self.cuts)
 
         print('Total Combined Spectra after filtering: ', filtered_index.shape[0])
         if self.continuum:
-            print('Total Individual Visit Spectra there: ', np.sum(hdulist[1].data['NVISITS'][filtered_index]))
+            print('Total Individual Visit Spectra there: ', np.sum(allstar_data['NVISITS'][filtered_index]))
 
         return filtered_index
 
@@ -109,458 +149,563 @@ class H5Compiler(object):
         return apogee_continuum(spectra=spectra, spectra_err=spectra_err, cont_mask=self.cont_mask, deg=2,
                                 dr=self.apogee_dr, bitmask=bitmask, target_bit=[0, 1, 2, 3, 4, 5, 6, 7, 12])
 
+    def star_download_args(self, allstar_data, indices):
+        """
+        Get the arguments to locate the spectra files of the selected stars
+
+        :param allstar_data: allStar columns from load_allstar()
+        :type allstar_data: astroNN.shared.catalog_cache.CatalogCache
+        :param indices: allStar indices of the stars
+        :type indices: ndarray
+        :return: list of keyword arguments for combined_spectra() or visit_spectra()
+        :rtype: list
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        apogee_ids = allstar_data['APOGEE_ID'][indices]
+        if self.apogee_dr <= 15:
+            location_ids = allstar_data['LOCATION_ID'][indices]
+            return [{'dr': self.apogee_dr, 'location': location_id, 'apogee': apogee_id, 'verbose': 0}
+                    for apogee_id, location_id in zip(apogee_ids, location_ids)]
+        else:
+            field_ids = allstar_data['FIELD'][indices]
+            telescope_ids = allstar_data['TELESCOPE'][indices]
+            return [{'dr': self.apogee_dr, 'field': field_id, 'telescope': telescope_id, 'apogee': apogee_id,
+                     'verbose': 0} for apogee_id, field_id, telescope_id in zip(apogee_ids, field_ids, telescope_ids)]
+
+    def load_star(self, d_args):
+        """
+        Read and normalize the spectra of a single star, this is the part of compile() running in worker processes
+
+        :param d_args: keyword arguments for combined_spectra() or visit_spectra()
+        :type d_args: dict
+        :return: spectra, spectra error, SNR and number of rows, None if the spectra file cannot be found
+        :rtype: Union[tuple, NoneType]
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        nvisits = 1
+        if not self.continuum:
+            path = combined_spectra(**d_args)
+            if path is False:
+                return None
+            combined_file = fits.open(path)
+            _spec = combined_file[1].data  # Pseudo-continuum normalized flux
+            _spec_err = combined_file[2].data  # Spectrum error array
+            _spec = gap_delete(_spec, dr=self.apogee_dr)  # Delete the gap between sensors
+            _spec_err = gap_delete(_spec_err, dr=self.apogee_dr)
+            inSNR = combined_file[0].header['SNR']
+            combined_file.close()
+        else:
+            path = visit_spectra(**d_args)
+            if path is False:
+                return None
+            apstar_file = fits.open(path)
+            nvisits = apstar_file[0].header['NVISITS']
+            if nvisits == 1:
+                _spec = apstar_file[1].data
+                _spec_err = apstar_file[2].data
+                _spec_mask = apstar_file[3].data
+                inSNR = np.ones(nvisits)
+                inSNR[0] = apstar_file[0].header['SNR']
+            else:
+                _spec = apstar_file[1].data[1:]
+                _spec_err = apstar_file[2].data[1:]
+                _spec_mask = apstar_file[3].data[1:]
+                inSNR = np.ones(nvisits + 1)
+                inSNR[0] = apstar_file[0].header['SNR']
+                for i in range(nvisits):
+                    inSNR[i + 1] = apstar_file[0].header[f'SNRVIS{i + 1}']
+
+                # Deal with spectra thats all zeros flux
+                ii = 0
+                while ii < _spec.shape[0]:
+                    if np.count_nonzero(_spec[ii]) == 0:
+                        nvisits -= 1
+                        _spec = np.delete(_spec, ii, 0)
+                        _spec_err = np.delete(_spec_err, ii, 0)
+                        _spec_mask = np.delete(_spec_mask, ii, 0)
+                        inSNR = np.delete(inSNR, ii, 0)
+                        ii -= 1
+                    ii += 1
+
+                # Just for the sake of program to work, the real nvisits still nvisits
+                nvisits += 1
+
+            # Normalize spectra and Set some bitmask to 0
+            _spec, _spec_err = self.apstar_normalization(_spec, _spec_err, _spec_mask)
+            apstar_file.close()
+
+        return _spec, _spec_err, inSNR, nvisits
+
+    def star_fingerprint(self, allstar_data, indices):
+        """
+        Checksum of the allStar entries used to compile each star, to tell whether a star has changed
+
+        :param allstar_data: allStar columns from load_allstar()
+        :type allstar_data: astroNN.shared.catalog_cache.CatalogCache
+        :param indices: allStar indices of the stars
+        :type indices: ndarray
+        :return: checksum of every star
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        # labels are gathered again for the whole file every compile, only columns affecting the spectra matter
+        names = ['APOGEE_ID', 'NVISITS']
+        names += ['LOCATION_ID'] if self.apogee_dr <= 15 else ['FIELD', 'TELESCOPE']
+        columns = [allstar_data[name][indices] for name in names]
+        return np.array([zlib.crc32(b''.join(column[i].tobytes() for column in columns))
+                         for i in range(indices.shape[0])], dtype=np.int64)
+
+    def spectra_storage(self):
+        """
+        Storage options of spectra and spectra_err datasets
+
+        :return: keyword arguments for h5py.File.create_dataset() and chunk_rows
+        :rtype: dict
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if self.spectra_dtype not in ['float32', 'float16']:
+            raise ValueError(f"Unknown spectra_dtype '{self.spectra_dtype}', only 'float32' or 'float16' is accepted")
+        storage = {'dtype': self.spectra_dtype, 'chunk_rows': self.chunk_rows}
+        if self.compression == 'blosc':
+            if hdf5plugin is None:
+                raise ImportError("hdf5plugin is required for 'blosc' compression, please install hdf5plugin")
+            clevel = 5 if self.compression_opts is None else self.compression_opts
+            shuffle = hdf5plugin.Blosc.SHUFFLE if self.shuffle is True else hdf5plugin.Blosc.NOSHUFFLE
+            storage.update(hdf5plugin.Blosc(cname='lz4', clevel=clevel, shuffle=shuffle))
+        elif self.compression in [None, 'lzf', 'gzip']:
+            storage.update({'compression': self.compression, 'compression_opts': self.compression_opts,
+                            'shuffle': self.shuffle})
+        else:
+            raise ValueError(f"Unknown compression '{self.compression}', only None, 'lzf', 'gzip' or 'blosc' is "
+                             f"accepted")
+        return storage
+
+    def prepare_resume(self, h5f, indices, fingerprints):
+        """
+        Drop unfinished writes, stars no longer selected and changed stars from a h5 file to be resumed
+
+        :param h5f: existing h5 file opened for writing
+        :type h5f: h5py.File
+        :param indices: allStar indices of the selected stars
+        :type indices: ndarray
+        :param fingerprints: checksum of the selected stars from star_fingerprint()
+        :type fingerprints: ndarray
+        :return: boolean array, True for selected stars which still need to be compiled
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        h5name = os.path.basename(h5f.filename)
+        if 'num_stars' not in h5f.attrs:
+            raise ValueError(f'{h5name} was not created by a resumable H5Compiler, please compile from scratch with '
+                             f'H5Compiler.resume=False')
+        for setting in _RESUME_SETTINGS:
+            if h5f.attrs[setting] != getattr(self, setting):
+                raise ValueError(f'{h5name} was compiled with {setting}={h5f.attrs[setting]} but '
+                                 f'H5Compiler.{setting}={getattr(self, setting)}, please compile from scratch with '
+                                 f'H5Compiler.resume=False')
+        if h5f.attrs['cont_mask_crc32'] != zlib.crc32(np.asarray(self.cont_mask).tobytes()):
+            raise ValueError(f'{h5name} was compiled with a different H5Compiler.cont_mask, please compile from '
+                             f'scratch with H5Compiler.resume=False')
+
+        for name in _DERIVED_DATASETS:
+            if name in h5f:
+                del h5f[name]
+
+        num_stars = h5f.attrs['num_stars']
+        num_rows = h5f.attrs['num_rows']
+        # only keep what was written completely before an interruption
+        for name in h5f:
+            h5f[name].resize(num_stars if name in _STAR_DATASETS else num_rows, axis=0)
+
+        done_index = h5f['index'][:]
+        done_fingerprint = h5f['fingerprint'][:]
+        # stars which are still selected and have not changed since they were compiled
+        keep_star = np.isin(done_index, indices)
+        order = np.argsort(indices)
+        current_fingerprint = fingerprints[order[np.searchsorted(indices, done_index[keep_star], sorter=order)]]
+        keep_star[keep_star] = done_fingerprint[keep_star] == current_fingerprint
+        keep_row = np.isin(h5f['allstar_index'][:], done_index[keep_star])
+
+        for name in h5f:
+            _compact_dataset(h5f[name], keep_star if name in _STAR_DATASETS else keep_row, self.batch_size)
+        h5f.attrs['num_stars'] = np.count_nonzero(keep_star)
+        h5f.attrs['num_rows'] = np.count_nonzero(keep_row)
+        print(f'Resuming {h5name}, {np.count_nonzero(keep_star)} stars are already compiled')
+
+        return ~np.isin(indices, done_index[keep_star])
+
     def compile(self):
         h5name_check(self.filename)
 
-        hdulist = self.load_allstar()
-        indices = self.filter_apogeeid_list(hdulist)
-
-        info = chips_pix_info(dr=self.apogee_dr)
-        total_pix = (info[1] - info[0]) + (info[3] - info[2]) + (info[5] - info[4])
-        default_length = 500000
-
-        spec = np.zeros((default_length, total_pix), dtype=np.float32)
-        spec_err = np.zeros((default_length, total_pix), dtype=np.float32)
-        RA = np.zeros(default_length, dtype=np.float32)
-        DEC = np.zeros(default_length, dtype=np.float32)
-        SNR = np.zeros(default_length, dtype=np.float32)
-        individual_flag = np.zeros(default_length, dtype=np.float32)
-        Kmag = np.zeros(default_length, dtype=np.float32)
-        AK_TARG = np.zeros(default_length, dtype=np.float32)
-
-        # Data array
-        teff = np.zeros(default_length, dtype=np.float32)
-        logg = np.zeros(default_length, dtype=np.float32)
-        MH = np.zeros(default_length, dtype=np.float32)
-        alpha_M = np.zeros(default_length, dtype=np.float32)
-        C = np.zeros(default_length, dtype=np.float32)
-        C1 = np.zeros(default_length, dtype=np.float32)
-        N = np.zeros(default_length, dtype=np.float32)
-        O = np.zeros(default_length, dtype=np.float32)
-        Na = np.zeros(default_length, dtype=np.float32)
-        Mg = np.zeros(default_length, dtype=np.float32)
-        Al = np.zeros(default_length, dtype=np.float32)
-        Si = np.zeros(default_length, dtype=np.float32)
-        P = np.zeros(default_length, dtype=np.float32)
-        S = np.zeros(default_length, dtype=np.float32)
-        K = np.zeros(default_length, dtype=np.float32)
-        Ca = np.zeros(default_length, dtype=np.float32)
-        Ti = np.zeros(default_length, dtype=np.float32)
-        Ti2 = np.zeros(default_length, dtype=np.float32)
-        V = np.zeros(default_length, dtype=np.float32)
-        Cr = np.zeros(default_length, dtype=np.float32)
-        Mn = np.zeros(default_length, dtype=np.float32)
-        Fe = np.zeros(default_length, dtype=np.float32)
-        Co = np.zeros(default_length, dtype=np.float32)
-        Ni = np.zeros(default_length, dtype=np.float32)
-        Cu = np.zeros(default_length, dtype=np.float32)
-        Ge = np.zeros(default_length, dtype=np.float32)
-        Ce = np.zeros(default_length, dtype=np.float32)
-        Rb = np.zeros(default_length, dtype=np.float32)
-        Y = np.zeros(default_length, dtype=np.float32)
-        Nd = np.zeros(default_length, dtype=np.float32)
-        parallax = np.zeros(default_length, dtype=np.float32)
-        fakemag = np.zeros(default_length, dtype=np.float32)
-
-        # Error array
-        teff_err = np.zeros(default_length, dtype=np.float32)
-        logg_err = np.zeros(default_length, dtype=np.float32)
-        MH_err = np.zeros(default_length, dtype=np.float32)
-        alpha_M_err = np.zeros(default_length, dtype=np.float32)
-        C_err = np.zeros(default_length, dtype=np.float32)
-        C1_err = np.zeros(default_length, dtype=np.float32)
-        N_err = np.zeros(default_length, dtype=np.float32)
-        O_err = np.zeros(default_length, dtype=np.float32)
-        Na_err = np.zeros(default_length, dtype=np.float32)
-        Mg_err = np.zeros(default_length, dtype=np.float32)
-        Al_err = np.zeros(default_length, dtype=np.float32)
-        Si_err = np.zeros(default_length, dtype=np.float32)
-        P_err = np.zeros(default_length, dtype=np.float32)
-        S_err = np.zeros(default_length, dtype=np.float32)
-        K_err = np.zeros(default_length, dtype=np.float32)
-        Ca_err = np.zeros(default_length, dtype=np.float32)
-        Ti_err = np.zeros(default_length, dtype=np.float32)
-        Ti2_err = np.zeros(default_length, dtype=np.float32)
-        V_err = np.zeros(default_length, dtype=np.float32)
-        Cr_err = np.zeros(default_length, dtype=np.float32)
-        Mn_err = np.zeros(default_length, dtype=np.float32)
-        Fe_err = np.zeros(default_length, dtype=np.float32)
-        Co_err = np.zeros(default_length, dtype=np.float32)
-        Ni_err = np.zeros(default_length, dtype=np.float32)
-        Cu_err = np.zeros(default_length, dtype=np.float32)
-        Ge_err = np.zeros(default_length, dtype=np.float32)
-        Ce_err = np.zeros(default_length, dtype=np.float32)
-        Rb_err = np.zeros(default_length, dtype=np.float32)
-        Y_err = np.zeros(default_length, dtype=np.float32)
-        Nd_err = np.zeros(default_length, dtype=np.float32)
-        parallax_err = np.zeros(default_length, dtype=np.float32)
-        fakemag_err = np.zeros(default_length, dtype=np.float32)
-
-        array_counter = 0
-
-        start_time = time.time()
+        allstar_data = self.load_allstar()
+        indices = self.filter_apogeeid_list(allstar_data)
 
         # provide a cont mask so no need to read every loop
         if self.cont_mask is None:
             maskpath = os.path.join(astroNN.data.datapath(), f'dr{self.apogee_dr}_contmask.npy')
             self.cont_mask = np.load(maskpath)
 
-        for counter, index in enumerate(indices):
-            nvisits = 1
-            apogee_id = hdulist[1].data['APOGEE_ID'][index]
-            if self.apogee_dr <= 15:
-                location_id = hdulist[1].data['LOCATION_ID'][index]
-                d_args = {'dr': self.apogee_dr, 'location': location_id, 'apogee': apogee_id, 'verbose': 0}
-            else:
-                field_id = hdulist[1].data['FIELD'][index]
-                telescope_id = hdulist[1].data['TELESCOPE'][index]
-                d_args = {'dr': self.apogee_dr, 'field': field_id, 'telescope': telescope_id, 'apogee': apogee_id,
-                          'verbose': 0}
-            if counter % 100 == 0:
-                print(f'Completed {counter + 1} of {indices.shape[0]}, {(time.time() - start_time):.{2}f}s elapsed')
-            if not self.continuum:
-                path = combined_spectra(**d_args)
-                if path is False:
-                    # if path is not found then we should skip
-                    continue
-                combined_file = fits.open(path)
-                _spec = combined_file[1].data  # Pseudo-continuum normalized flux
-                _spec_err = combined_file[2].data  # Spectrum error array
-                _spec = gap_delete(_spec, dr=self.apogee_dr)  # Delete the gap between sensors
-                _spec_err = gap_delete(_spec_err, dr=self.apogee_dr)
-                inSNR = combined_file[0].header['SNR']
-                combined_file.close()
-            else:
-                path = visit_spectra(**d_args)
-                if path is False:
+        fingerprints = self.star_fingerprint(allstar_data, indices)
+
+        if self.shard_size is None:
+            self.compile_file(self.filename, allstar_data, indices, fingerprints)
+        else:
+            shards = []
+            for counter, start in enumerate(range(0, indices.shape[0], self.shard_size)):
+                shard_name = f'{self.filename}_shard{counter:04d}'
+                self.compile_file(shard_name, allstar_data, indices[start:start + self.shard_size],
+                                  fingerprints[start:start + self.shard_size])
+                shards.append(f'{shard_name}.h5')
+            h5_virtual_index(f'{self.filename}.h5', shards)
+            print(f'Successfully created {self.filename}.h5 with {len(shards)} shards in {currentdir}')
+
+    def compile_file(self, filename, allstar_data, indices, fingerprints):
+        """
+        Compile spectra and labels of some stars into a single h5 file
+
+        :param filename: filename of the h5 file without .h5 extension
+        :type filename: str
+        :param allstar_data: allStar columns from load_allstar()
+        :type allstar_data: astroNN.shared.catalog_cache.CatalogCache
+        :param indices: allStar indices of the stars
+        :type indices: ndarray
+        :param fingerprints: checksum of the stars from star_fingerprint()
+        :type fingerprints: ndarray
+        :return: None
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        start_time = time.time()
+
+        if self.resume is True and os.path.isfile(f'{filename}.h5'):
+            h5f = h5py.File(f'{filename}.h5', 'r+')
+            todo = self.prepare_resume(h5f, indices, fingerprints)
+            indices, fingerprints = indices[todo], fingerprints[todo]
+        else:
+            print(f'Creating {filename}.h5')
+            h5f = h5py.File(f'{filename}.h5', 'w')
+            for setting in _RESUME_SETTINGS:
+                h5f.attrs[setting] = getattr(self, setting)
+            h5f.attrs['cont_mask_crc32'] = zlib.crc32(np.asarray(self.cont_mask).tobytes())
+
+        # download arguments of every star, gathered in one go instead of indexing allStar in the loop
+        star_args = self.star_download_args(allstar_data, indices)
+
+        if self.workers is None or self.workers > 1:
+            pool = multiprocessing.Pool(processes=self.workers)
+            # imap (instead of imap_unordered) so rows come back in allStar order, same as single process compile
+            star_results = pool.imap(self.load_star, star_args, chunksize=16)
+        else:
+            pool = None
+            star_results = map(self.load_star, star_args)
+
+        with h5f:
+            # spectra are written to the file batch by batch, so memory usage does not grow with the catalog
+            storage = self.spectra_storage()
+            writer = _H5RowWriter(h5f, batch_size=self.batch_size,
+                                  storage={'spectra': storage, 'spectra_err': storage})
+
+            for counter, (index, fingerprint, star) in enumerate(zip(indices, fingerprints, star_results)):
+                if counter % 100 == 0:
+                    print(f'Completed {counter + 1} of {indices.shape[0]}, '
+                          f'{(time.time() - start_time):.{2}f}s elapsed')
+                # stars are recorded even if the spectra are not found, so they are not retried when resuming
+                star_info = {'index': np.array([index]), 'fingerprint': np.array([fingerprint])}
+                if star is None:
                     # if path is not found then we should skip
+                    writer.append(0, star_info)
                     continue
-                apstar_file = fits.open(path)
-                nvisits = apstar_file[0].header['NVISITS']
-                if nvisits == 1:
-                    _spec = apstar_file[1].data
-                    _spec_err = apstar_file[2].data
-                    _spec_mask = apstar_file[3].data
-                    inSNR = np.ones(nvisits)
-                    inSNR[0] = apstar_file[0].header['SNR']
-                else:
-                    _spec = apstar_file[1].data[1:]
-                    _spec_err = apstar_file[2].data[1:]
-                    _spec_mask = apstar_file[3].data[1:]
-                    inSNR = np.ones(nvisits + 1)
-                    inSNR[0] = apstar_file[0].header['SNR']
-                    for i in range(nvisits):
-                        inSNR[i + 1] = apstar_file[0].header[f'SNRVIS{i + 1}']
-
-                    # Deal with spectra thats all zeros flux
-                    ii = 0
-                    while ii < _spec.shape[0]:
-                        if np.count_nonzero(_spec[ii]) == 0:
-                            nvisits -= 1
-                            _spec = np.delete(_spec, ii, 0)
-                            _spec_err = np.delete(_spec_err, ii, 0)
-                            _spec_mask = np.delete(_spec_mask, ii, 0)
-                            inSNR = np.delete(inSNR, ii, 0)
-                            ii -= 1
-                        ii += 1
-
-                    # Just for the sake of program to work, the real nvisits still nvisits
-                    nvisits += 1
-
-                # Normalize spectra and Set some bitmask to 0
-                _spec, _spec_err = self.apstar_normalization(_spec, _spec_err, _spec_mask)
-                apstar_file.close()
+                _spec, _spec_err, inSNR, nvisits = star
 
-            if nvisits == 1:
-                individual_flag[array_counter:array_counter + nvisits] = 0
-            else:
-                individual_flag[array_counter:array_counter + 1] = 0
-                individual_flag[array_counter + 1:array_counter + nvisits] = 1
-            spec[array_counter:array_counter + nvisits, :] = _spec
-            spec_err[array_counter:array_counter + nvisits, :] = _spec_err
-            SNR[array_counter:array_counter + nvisits] = inSNR
-            RA[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['RA'][index], nvisits)
-            DEC[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['DEC'][index], nvisits)
-            parallax[array_counter:array_counter + nvisits] = np.tile(-9999, nvisits)
-            parallax_err[array_counter:array_counter + nvisits] = np.tile(-9999, nvisits)
-            fakemag[array_counter:array_counter + nvisits] = np.tile(-9999, nvisits)
-            fakemag_err[array_counter:array_counter + nvisits] = np.tile(-9999, nvisits)
-            Kmag[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['K'][index], nvisits)
-            AK_TARG[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['AK_TARG'][index], nvisits)
+                individual_flag = np.ones(nvisits, dtype=np.float32)
+                individual_flag[0] = 0  # first row is the combined spectrum
+                # only the allStar row of every spectrum is recorded here, labels are gathered after the loop
+                rows = {'spectra': _spec, 'spectra_err': _spec_err, 'in_flag': individual_flag,
+                        'allstar_index': np.repeat(index, nvisits)}
+                if self.spectra_only is not True:
+                    rows['SNR'] = np.atleast_1d(inSNR)
+
+                writer.append(nvisits, star_info, **rows)
+
+            writer.flush()
+
+            if pool is not None:
+                pool.close()
+                pool.join()
 
             if self.spectra_only is not True:
-                teff[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['PARAM'][index, 0], nvisits)
-                logg[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['PARAM'][index, 1], nvisits)
-                MH[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['PARAM'][index, 3], nvisits)
-                alpha_M[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['PARAM'][index, 6],
-                                                                         nvisits)
-                C[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 0], nvisits)
-                C1[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 1], nvisits)
-                N[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 2], nvisits)
-                O[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 3], nvisits)
-                Na[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 4], nvisits)
-                Mg[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 5], nvisits)
-                Al[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 6], nvisits)
-                Si[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 7], nvisits)
-                P[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 8], nvisits)
-                S[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 9], nvisits)
-                K[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 10], nvisits)
-                Ca[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 11], nvisits)
-                Ti[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 12], nvisits)
-                Ti2[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 13], nvisits)
-                V[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 14], nvisits)
-                Cr[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 15], nvisits)
-                Mn[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 16], nvisits)
-                Fe[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 17], nvisits)
-                Co[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 18], nvisits)
-                Ni[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 19], nvisits)
-                Cu[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 20], nvisits)
-                Ge[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 21], nvisits)
-                Ce[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 22], nvisits)
-                Rb[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 23], nvisits)
-                Y[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 24], nvisits)
-                Nd[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H'][index, 25], nvisits)
-
-                if self.use_err is True:
-                    teff_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['TEFF_ERR'][index],
-                                                                              nvisits)
-                    logg_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['LOGG_ERR'][index],
-                                                                              nvisits)
-                    MH_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['M_H_ERR'][index],
-                                                                            nvisits)
-                    alpha_M_err[array_counter:array_counter + nvisits] = np.tile(
-                        hdulist[1].data['ALPHA_M_ERR'][index]
-                        , nvisits)
-                    C_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 0],
-                                                                           nvisits)
-                    C1_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 1],
-                                                                            nvisits)
-                    N_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 2],
-                                                                           nvisits)
-                    O_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 3],
-                                                                           nvisits)
-                    Na_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 4],
-                                                                            nvisits)
-                    Mg_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 5],
-                                                                            nvisits)
-                    Al_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 6],
-                                                                            nvisits)
-                    Si_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 7],
-                                                                            nvisits)
-                    P_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 8],
-                                                                           nvisits)
-                    S_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 9],
-                                                                           nvisits)
-                    K_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 10],
-                                                                           nvisits)
-                    Ca_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 11],
-                                                                            nvisits)
-                    Ti_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 12],
-                                                                            nvisits)
-                    Ti2_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 13],
-                                                                             nvisits)
-                    V_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 14],
-                                                                           nvisits)
-                    Cr_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 15],
-                                                                            nvisits)
-                    Mn_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 16],
-                                                                            nvisits)
-                    Fe_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 17],
-                                                                            nvisits)
-                    Co_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 18],
-                                                                            nvisits)
-                    Ni_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 19],
-                                                                            nvisits)
-                    Cu_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 20],
-                                                                            nvisits)
-                    Ge_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 21],
-                                                                            nvisits)
-                    Ce_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 22],
-                                                                            nvisits)
-                    Rb_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 23],
-                                                                            nvisits)
-                    Y_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 24],
-                                                                           nvisits)
-                    Nd_err[array_counter:array_counter + nvisits] = np.tile(hdulist[1].data['X_H_ERR'][index, 25],
-                                                                            nvisits)
-            array_counter += nvisits
-
-        spec = spec[0:array_counter]
-        spec_err = spec_err[0:array_counter]
-        individual_flag = individual_flag[0:array_counter]
-        RA = RA[0:array_counter]
-        DEC = DEC[0:array_counter]
-        SNR = SNR[0:array_counter]
-
-        if self.spectra_only is not True:
-            teff = teff[0:array_counter]
-            logg = logg[0:array_counter]
-            Kmag = Kmag[0:array_counter]
-            AK_TARG = AK_TARG[0:array_counter]
-            MH = MH[0:array_counter]
-            alpha_M = alpha_M[0:array_counter]
-            C = C[0:array_counter]
-            C1 = C1[0:array_counter]
-            N = N[0:array_counter]
-            O = O[0:array_counter]
-            Na = Na[0:array_counter]
-            Mg = Mg[0:array_counter]
-            Al = Al[0:array_counter]
-            Si = Si[0:array_counter]
-            P = P[0:array_counter]
-            S = S[0:array_counter]
-            K = K[0:array_counter]
-            Ca = Ca[0:array_counter]
-            Ti = Ti[0:array_counter]
-            Ti2 = Ti2[0:array_counter]
-            V = V[0:array_counter]
-            Cr = Cr[0:array_counter]
-            Mn = Mn[0:array_counter]
-            Fe = Fe[0:array_counter]
-            Co = Co[0:array_counter]
-            Ni = Ni[0:array_counter]
-            Cu = Cu[0:array_counter]
-            Ge = Ge[0:array_counter]
-            Ce = Ce[0:array_counter]
-            Rb = Rb[0:array_counter]
-            Y = Y[0:array_counter]
-            Nd = Nd[0:array_counter]
-            parallax = parallax[0:array_counter]
-            fakemag = fakemag[0:array_counter]
-
-            teff_err = teff_err[0:array_counter]
-            logg_err = logg_err[0:array_counter]
-            MH_err = MH_err[0:array_counter]
-            alpha_M_err = alpha_M_err[0:array_counter]
-            C_err = C_err[0:array_counter]
-            C1_err = C1_err[0:array_counter]
-            N_err = N_err[0:array_counter]
-            O_err = O_err[0:array_counter]
-            Na_err = Na_err[0:array_counter]
-            Mg_err = Mg_err[0:array_counter]
-            Al_err = Al_err[0:array_counter]
-            Si_err = Si_err[0:array_counter]
-            P_err = P_err[0:array_counter]
-            S_err = S_err[0:array_counter]
-            K_err = K_err[0:array_counter]
-            Ca_err = Ca_err[0:array_counter]
-            Ti_err = Ti_err[0:array_counter]
-            Ti2_err = Ti2_err[0:array_counter]
-            V_err = V_err[0:array_counter]
-            Cr_err = Cr_err[0:array_counter]
-            Mn_err = Mn_err[0:array_counter]
-            Fe_err = Fe_err[0:array_counter]
-            Co_err = Co_err[0:array_counter]
-            Ni_err = Ni_err[0:array_counter]
-            Cu_err = Cu_err[0:array_counter]
-            Ge_err = Ge_err[0:array_counter]
-            Ce_err = Ce_err[0:array_counter]
-            Rb_err = Rb_err[0:array_counter]
-            Y_err = Y_err[0:array_counter]
-            Nd_err = Nd_err[0:array_counter]
-            parallax_err = parallax_err[0:array_counter]
-            fakemag_err = fakemag_err[0:array_counter]
-
-            if self.use_esa_gaia is True:
-                gaia_ra, gaia_dec, gaia_parallax, gaia_err = gaiadr2_parallax(cuts=True, keepdims=False)
-                m1, m2, sep = xmatch(RA, gaia_ra, maxdist=2, colRA1=RA, colDec1=DEC, colRA2=gaia_ra, colDec2=gaia_dec,
-                                     swap=False)
-                parallax[m1] = gaia_parallax[m2]
-                parallax_err[m1] = gaia_err[m2]
-                fakemag[m1], fakemag_err[m1] = mag_to_fakemag(extinction_correction(Kmag[m1], AK_TARG[m1]),
-                                                              parallax[m1], parallax_err[m1])
-            elif self.use_anderson_2017 is True:
-                gaia_ra, gaia_dec, gaia_parallax, gaia_err = anderson_2017_parallax()
-                m1, m2, sep = xmatch(RA, gaia_ra, maxdist=2, colRA1=RA, colDec1=DEC, epoch1=2000., colRA2=gaia_ra,
-                                     colDec2=gaia_dec, epoch2=2000., swap=False)
-                parallax[m1] = gaia_parallax[m2]
-                parallax_err[m1] = gaia_err[m2]
-                fakemag[m1], fakemag_err[m1] = mag_to_fakemag(extinction_correction(Kmag[m1], AK_TARG[m1]),
-                                                              parallax[m1], parallax_err[m1])
-
-        print(f'Creating {self.filename}.h5')
-        h5f = h5py.File(f'{self.filename}.h5', 'w')
-        h5f.create_dataset('spectra', data=spec)
-        h5f.create_dataset('spectra_err', data=spec_err)
-        h5f.create_dataset('in_flag', data=individual_flag)
-        h5f.create_dataset('index', data=indices)
-
-        if self.spectra_only is not True:
-            h5f.create_dataset('SNR', data=SNR)
-            h5f.create_dataset('RA', data=RA)
-            h5f.create_dataset('DEC', data=DEC)
-            h5f.create_dataset('Kmag', data=Kmag)
-            h5f.create_dataset('AK_TARG', data=AK_TARG)
-            h5f.create_dataset('teff', data=teff)
-            h5f.create_dataset('logg', data=logg)
-            h5f.create_dataset('M', data=MH)
-            h5f.create_dataset('alpha', data=alpha_M)
-            h5f.create_dataset('C', data=C)
-            h5f.create_dataset('C1', data=C1)
-            h5f.create_dataset('N', data=N)
-            h5f.create_dataset('O', data=O)
-            h5f.create_dataset('Na', data=Na)
-            h5f.create_dataset('Mg', data=Mg)
-            h5f.create_dataset('Al', data=Al)
-            h5f.create_dataset('Si', data=Si)
-            h5f.create_dataset('P', data=P)
-            h5f.create_dataset('S', data=S)
-            h5f.create_dataset('K', data=K)
-            h5f.create_dataset('Ca', data=Ca)
-            h5f.create_dataset('Ti', data=Ti)
-            h5f.create_dataset('Ti2', data=Ti2)
-            h5f.create_dataset('V', data=V)
-            h5f.create_dataset('Cr', data=Cr)
-            h5f.create_dataset('Mn', data=Mn)
-            h5f.create_dataset('Fe', data=Fe)
-            h5f.create_dataset('Co', data=Co)
-            h5f.create_dataset('Ni', data=Ni)
-            h5f.create_dataset('Cu', data=Cu)
-            h5f.create_dataset('Ge', data=Ge)
-            h5f.create_dataset('Ce', data=Ce)
-            h5f.create_dataset('Rb', data=Rb)
-            h5f.create_dataset('Y', data=Y)
-            h5f.create_dataset('Nd', data=Nd)
-            h5f.create_dataset('parallax', data=parallax)
-            h5f.create_dataset('fakemag', data=fakemag)
+                labels = self.compile_labels(h5f, allstar_data)
+                labels.update(self.compile_parallax(h5f))
+                self.write_labels(h5f, labels)
+
+            if self.spectra_only is not True and self.use_err is True:
+                h5f.create_dataset('AK_TARG_err', data=np.zeros(writer.total_rows, dtype=np.float32))
+
+        print(f'Successfully created {filename}.h5 in {currentdir}')
 
+    def compile_labels(self, h5f, allstar_data):
+        """
+        Write allStar information and gather ASPCAP labels of every spectrum in the h5 file, each allStar column is
+        gathered with a single fancy indexing over the allStar row of every spectrum
+
+        :param h5f: h5 file being compiled
+        :type h5f: h5py.File
+        :param allstar_data: allStar columns from load_allstar()
+        :type allstar_data: astroNN.shared.catalog_cache.CatalogCache
+        :return: ASPCAP labels and their errors to be written by write_labels()
+        :rtype: dict
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        allstar_index = h5f['allstar_index'][:]
+        labels = _ALLSTAR_INFO + [(name, column) for name, column, column_idx in _ASPCAP_LABELS]
+        label_idx = [None] * len(_ALLSTAR_INFO) + [column_idx for name, column, column_idx in _ASPCAP_LABELS]
+        if self.use_err is True:
+            labels += [(name, column) for name, column, column_idx in _ASPCAP_LABELS_ERR]
+            label_idx += [column_idx for name, column, column_idx in _ASPCAP_LABELS_ERR]
+
+        gathered = {}
+        aspcap_labels = {}
+        for (name, column), column_idx in zip(labels, label_idx):
+            if column not in gathered:
+                gathered[column] = allstar_data[column][allstar_index]
+            data = gathered[column] if column_idx is None else gathered[column][:, column_idx]
+            if name in [info_name for info_name, info_column in _ALLSTAR_INFO]:
+                h5f.create_dataset(name, data=data.astype(np.float32), maxshape=(None,), chunks=True)
+            else:
+                aspcap_labels[name] = data.astype(np.float32)
+        return aspcap_labels
+
+    def compile_parallax(self, h5f):
+        """
+        Cross-match the compiled spectra with parallax catalog to get parallax and fakemag
+
+        :param h5f: h5 file being compiled
+        :type h5f: h5py.File
+        :return: parallax and fakemag and their errors to be written by write_labels()
+        :rtype: dict
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        RA = np.array(h5f['RA'])
+        DEC = np.array(h5f['DEC'])
+        Kmag = np.array(h5f['Kmag'])
+        AK_TARG = np.array(h5f['AK_TARG'])
+
+        parallax = np.tile(np.float32(-9999.), RA.shape[0])
+        parallax_err = np.tile(np.float32(-9999.), RA.shape[0])
+        fakemag = np.tile(np.float32(-9999.), RA.shape[0])
+        fakemag_err = np.tile(np.float32(-9999.), RA.shape[0])
+
+        if self.use_esa_gaia is True:
+            gaia_ra, gaia_dec, gaia_parallax, gaia_err = gaiadr2_parallax(cuts=True, keepdims=False)
+            m1, m2, sep = xmatch(RA, gaia_ra, maxdist=2, colRA1=RA, colDec1=DEC, colRA2=gaia_ra, colDec2=gaia_dec,
+                                 swap=False)
+            parallax[m1] = gaia_parallax[m2]
+            parallax_err[m1] = gaia_err[m2]
+            fakemag[m1], fakemag_err[m1] = mag_to_fakemag(extinction_correction(Kmag[m1], AK_TARG[m1]),
+                                                          parallax[m1], parallax_err[m1])
+        elif self.use_anderson_2017 is True:
+            gaia_ra, gaia_dec, gaia_parallax, gaia_err = anderson_2017_parallax()
+            m1, m2, sep = xmatch(RA, gaia_ra, maxdist=2, colRA1=RA, colDec1=DEC, epoch1=2000., colRA2=gaia_ra,
+                                 colDec2=gaia_dec, epoch2=2000., swap=False)
+            parallax[m1] = gaia_parallax[m2]
+            parallax_err[m1] = gaia_err[m2]
+            fakemag[m1], fakemag_err[m1] = mag_to_fakemag(extinction_correction(Kmag[m1], AK_TARG[m1]),
+                                                          parallax[m1], parallax_err[m1])
+
+        labels = {'parallax': parallax, 'fakemag': fakemag}
+        if self.use_err is True:
+            labels.update({'parallax_err': parallax_err, 'fakemag_err': fakemag_err})
+        return labels
+
+    def write_labels(self, h5f, labels):
+        """
+        Write labels to the h5 file, as a dataset for each label or as 2D 'labels' and 'labels_err' datasets with the
+        names of the columns in attribute 'names' if H5Compiler.label_matrix is True
+
+        :param h5f: h5 file being compiled
+        :type h5f: h5py.File
+        :param labels: labels and their errors, errors have the name of the label with '_err' suffix
+        :type labels: dict
+        :return: None
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if self.label_matrix is True:
+            names = [name for name in labels if not name.endswith('_err')]
+            matrices = [('labels', names)]
             if self.use_err is True:
-                h5f.create_dataset('AK_TARG_err', data=np.zeros_like(AK_TARG))
-                h5f.create_dataset('teff_err', data=teff_err)
-                h5f.create_dataset('logg_err', data=logg_err)
-                h5f.create_dataset('M_err', data=MH_err)
-                h5f.create_dataset('alpha_err', data=alpha_M_err)
-                h5f.create_dataset('C_err', data=C_err)
-                h5f.create_dataset('C1_err', data=C1_err)
-                h5f.create_dataset('N_err', data=N_err)
-                h5f.create_dataset('O_err', data=O_err)
-                h5f.create_dataset('Na_err', data=Na_err)
-                h5f.create_dataset('Mg_err', data=Mg_err)
-                h5f.create_dataset('Al_err', data=Al_err)
-                h5f.create_dataset('Si_err', data=Si_err)
-                h5f.create_dataset('P_err', data=P_err)
-                h5f.create_dataset('S_err', data=S_err)
-                h5f.create_dataset('K_err', data=K_err)
-                h5f.create_dataset('Ca_err', data=Ca_err)
-                h5f.create_dataset('Ti_err', data=Ti_err)
-                h5f.create_dataset('Ti2_err', data=Ti2_err)
-                h5f.create_dataset('V_err', data=V_err)
-                h5f.create_dataset('Cr_err', data=Cr_err)
-                h5f.create_dataset('Mn_err', data=Mn_err)
-                h5f.create_dataset('Fe_err', data=Fe_err)
-                h5f.create_dataset('Co_err', data=Co_err)
-                h5f.create_dataset('Ni_err', data=Ni_err)
-                h5f.create_dataset('Cu_err', data=Cu_err)
-                h5f.create_dataset('Ge_err', data=Ge_err)
-                h5f.create_dataset('Ce_err', data=Ce_err)
-                h5f.create_dataset('Rb_err', data=Rb_err)
-                h5f.create_dataset('Y_err', data=Y_err)
-                h5f.create_dataset('Nd_err', data=Nd_err)
-                h5f.create_dataset('parallax_err', data=parallax_err)
-                h5f.create_dataset('fakemag_err', data=fakemag_err)
-
-        h5f.close()
-        print(f'Successfully created {self.filename}.h5 in {currentdir}')
+                matrices.append(('labels_err', [f'{name}_err' for name in names]))
+            for matrix_name, columns in matrices:
+                matrix = np.empty((labels[names[0]].shape[0], len(names)), dtype=np.float32)
+                for counter, name in enumerate(columns):
+                    matrix[:, counter] = labels[name]
+                h5f.create_dataset(matrix_name, data=matrix, maxshape=(None, len(names)), chunks=True)
+                h5f[matrix_name].attrs['names'] = names
+        else:
+            for name, data in labels.items():
+                h5f.create_dataset(name, data=data, maxshape=(None,), chunks=True)
+
+
+class _H5RowWriter(object):
+    """
+    Buffer rows in memory and append them to resizable, chunked datasets of a h5 file one batch at a time,
+    the number of rows and stars completely written are kept in the file attributes so an interrupted compile can
+    be resumed
+
+    :param h5f: h5 file opened for writing
+    :type h5f: h5py.File
+    :param batch_size: number of rows buffered before writing to the file
+    :type batch_size: int
+    :param storage: keyword arguments for h5py.File.create_dataset() and chunk_rows for some datasets
+    :type storage: dict
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, h5f, batch_size=1024, storage=None):
+        self.h5f = h5f
+        self.batch_size = batch_size
+        self.storage = {} if storage is None else storage
+        self.buffer = {}
+        self.buffered_rows = 0
+        self.buffered_stars = 0
+        self.total_rows = int(h5f.attrs.get('num_rows', 0))
+        self.total_stars = int(h5f.attrs.get('num_stars', 0))
+
+    def append(self, num_rows, star_info, **rows):
+        for name, data in {**star_info, **rows}.items():
+            self.buffer.setdefault(name, []).append(data)
+        self.buffered_rows += num_rows
+        self.buffered_stars += 1
+        if self.buffered_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for name, data in self.buffer.items():
+            data = np.concatenate(data, axis=0)
+            if data.dtype.kind == 'f':
+                data = data.astype(np.float32)
+            if name not in self.h5f:
+                kwds = dict(self.storage.get(name, {}))
+                chunk_rows = kwds.pop('chunk_rows', None)
+                chunks = True if chunk_rows is None else (chunk_rows, *data.shape[1:])
+                self.h5f.create_dataset(name, data=data, maxshape=(None, *data.shape[1:]), chunks=chunks, **kwds)
+            else:
+                dset = self.h5f[name]
+                dset.resize(dset.shape[0] + data.shape[0], axis=0)
+                dset[-data.shape[0]:] = data
+        self.total_rows += self.buffered_rows
+        self.total_stars += self.buffered_stars
+        # only mark the batch as written after every dataset got it
+        self.h5f.attrs['num_rows'] = self.total_rows
+        self.h5f.attrs['num_stars'] = self.total_stars
+        self.h5f.flush()
+        self.buffer = {}
+        self.buffered_rows = 0
+        self.buffered_stars = 0
+
+
+def _compact_dataset(dset, keep, batch_size=1024):
+    """
+    Remove entries of a resizable h5 dataset in place, batch by batch so the dataset is never fully loaded
+
+    :param dset: resizable h5 dataset
+    :type dset: h5py.Dataset
+    :param keep: boolean array, True for entries to keep
+    :type keep: ndarray
+    :param batch_size: number of entries to read at a time
+    :type batch_size: int
+    :return: None
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    write_idx = 0
+    for start in range(0, dset.shape[0], batch_size):
+        keep_batch = keep[start:start + batch_size]
+        num_keep = np.count_nonzero(keep_batch)
+        # nothing removed so far, no need to move anything
+        if num_keep > 0 and (write_idx != start or num_keep != keep_batch.shape[0]):
+            dset[write_idx:write_idx + num_keep] = dset[start:start + batch_size][keep_batch]
+        write_idx += num_keep
+    dset.resize(write_idx, axis=0)
+
+
+def h5_virtual_index(filename, shards):
+    """
+    Combine h5 files compiled by H5Compiler (shards, e.g. one for every DR or field) into a single h5 file with HDF5
+    virtual datasets, every dataset in the index file is the datasets of the shards concatenated along the first axis.
+    No data is copied so the index file is tiny and can be loaded with H5Loader like any compiled h5 file. The shards
+    are referred by their path relative to the index file, so keep them in the same relative location.
+
+    :param filename: filename of the index h5 file
+    :type filename: str
+    :param shards: filenames of the shards, in the order to be concatenated
+    :type shards: list
+    :return: None
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    if len(shards) == 0:
+        raise ValueError('At least one shard is required')
+    folder = os.path.dirname(os.path.abspath(filename))
+    datasets = []
+    for shard in shards:
+        with h5py.File(shard, 'r') as F:
+            datasets.append({name: (dset.shape, dset.dtype, dict(dset.attrs)) for name, dset in F.items()
+                             if isinstance(dset, h5py.Dataset)})
+            if shard == shards[0]:
+                file_attrs = dict(F.attrs)
+            # settings are only kept if every shard is compiled with the same settings
+            for setting in list(file_attrs.keys()):
+                if setting not in F.attrs or np.any(F.attrs[setting] != file_attrs[setting]):
+                    del file_attrs[setting]
+
+    # only datasets every shard has can be concatenated
+    names = [name for name in datasets[0] if all(name in shard_datasets for shard_datasets in datasets)]
+    with h5py.File(filename, 'w') as h5f:
+        for name in names:
+            shape, dtype, attrs = datasets[0][name]
+            for shard, shard_datasets in zip(shards, datasets):
+                shard_shape, shard_dtype, shard_attrs = shard_datasets[name]
+                if shard_shape[1:] != shape[1:] or shard_dtype != dtype or \
+                        np.any(shard_attrs.get('names') != attrs.get('names')):
+                    raise ValueError(f"Dataset '{name}' in {shard} has shape {shard_shape} and dtype {shard_dtype}, "
+                                     f"which cannot be concatenated with shape {shape} and dtype {dtype} in "
+                                     f"{shards[0]}")
+            layout = h5py.VirtualLayout(shape=(sum(shard_datasets[name][0][0] for shard_datasets in datasets),
+                                               *shape[1:]), dtype=dtype)
+            start = 0
+            for shard, shard_datasets in zip(shards, datasets):
+                num_rows = shard_datasets[name][0][0]
+                if num_rows > 0:
+                    # relative path is resolved from the folder of the index file by HDF5
+                    source = h5py.VirtualSource(os.path.relpath(os.path.abspath(shard), folder), name,
+                                                shape=shard_datasets[name][0])
+                    layout[start:start + num_rows] = source
+                start += num_rows
+            h5f.create_virtual_dataset(name, layout)
+            for key, value in attrs.items():
+                h5f[name].attrs[key] = value
+
+        for setting, value in file_attrs.items():
+            h5f.attrs[setting] = value
+        for count_attr, dataset_name in [('num_rows', 'in_flag'), ('num_stars', 'index')]:
+            if dataset_name in h5f:
+                h5f.attrs[count_attr] = h5f[dataset_name].shape[0]
+            elif count_attr in h5f.attrs:
+                del h5f.attrs[count_attr]
+        h5f.attrs['shards'] = [os.path.relpath(os.path.abspath(shard), folder) for shard in shards]
+
+
+def _h5_files(h5path):
+    """
+    Paths of a h5 file and the shards of it if it is an index file from h5_virtual_index()
+
+    :param h5path: path to the h5 file
+    :type h5path: str
+    :return: paths of the h5 file and its shards
+    :rtype: list
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    with h5py.File(h5path, 'r') as F:
+        shards = list(F.attrs.get('shards', []))
+    folder = os.path.dirname(h5path)
+    return [h5path] + [os.path.join(folder, shard) for shard in shards]
 
 
 class H5Loader(object):
@@ -571,6 +716,8 @@ class H5Loader(object):
         self.load_combined = True
         self.load_err = False
         self.exclude9999 = False
+        self.lazy = False  # True to return spectra as H5LazyArray which only reads rows from the file when indexed
+        self.store_allowed_index = False  # True to store the indices of spectra to load in the h5 file for next time
 
         if os.path.isfile(os.path.join(self.currentdir, self.filename)) is True:
             self.h5path = os.path.join(self.currentdir, self.filename)
@@ -579,60 +726,76 @@ class H5Loader(object):
         else:
             raise FileNotFoundError(f'Cannot find {os.path.join(self.currentdir, self.filename)}')
 
+        # HDF5 silently gives fill values for missing shards of virtual datasets
+        for h5path in _h5_files(self.h5path)[1:]:
+            if not os.path.isfile(h5path):
+                raise FileNotFoundError(f'Cannot find shard {h5path} of {self.h5path}')
+
         self.target = target_conversion(self.target)
 
     def load_allowed_index(self):
-        with h5py.File(self.h5path) as F:  # ensure the file will be cleaned up
-            if self.exclude9999 is True:
-                index_not9999 = None
-                for counter, tg in enumerate(self.target):
-                    if index_not9999 is None:
-                        index_not9999 = np.arange(F[f'{tg}'].shape[0])
-                    temp_index = np.where(np.array(F[f'{tg}']) != -9999)[0]
-                    index_not9999 = reduce(np.intersect1d, (index_not9999, temp_index))
-
-                in_flag = index_not9999
-                if self.load_combined is True:
-                    in_flag = np.where(np.array(F['in_flag']) == 0)[0]
-                elif self.load_combined is False:
-                    in_flag = np.where(np.array(F['in_flag']) == 1)[0]
-
-                allowed_index = reduce(np.intersect1d, (index_not9999, in_flag))
+        """
+        Indices of spectra to load according to load_combined and exclude9999, the indices are cached in memory for
+        every combination of file, target and flags, and optionally stored in the h5 file
 
+        :return: sorted indices of spectra
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
+        """
+        # target only matters if spectra with -9999 labels are excluded
+        key = f'load_combined={self.load_combined}, exclude9999={self.exclude9999}' + \
+              (f', target={list(self.target)}' if self.exclude9999 is True else '')
+        # file modification time is in the key so a recompiled file or shard is never served from the cache
+        memory_key = (self.h5path, tuple(os.stat(h5path).st_mtime_ns for h5path in _h5_files(self.h5path)), key)
+        if memory_key in _ALLOWED_INDEX_TEMP:
+            return _ALLOWED_INDEX_TEMP[memory_key].copy()
+
+        stored_name = f'allowed_index/{zlib.crc32(key.encode())}'
+        stored = False
+        with h5py.File(self.h5path, 'r') as F:  # ensure the file will be cleaned up
+            if stored_name in F and F[stored_name].attrs['key'] == key:
+                allowed_index = F[stored_name][()]
+                stored = True
             else:
-                in_flag = []
+                mask = np.ones(F['in_flag'].shape[0], dtype=bool)
                 if self.load_combined is True:
-                    in_flag = np.where(np.array(F['in_flag']) == 0)[0]
+                    mask &= F['in_flag'][()] == 0
                 elif self.load_combined is False:
-                    in_flag = np.where(np.array(F['in_flag']) == 1)[0]
-
-                allowed_index = in_flag
+                    mask &= F['in_flag'][()] == 1
+                if self.exclude9999 is True:
+                    mask &= np.all(_read_labels(F, self.target) != -9999, axis=1)
+                allowed_index = np.nonzero(mask)[0]
 
-            F.close()
+        if self.store_allowed_index is True and stored is False:
+            with h5py.File(self.h5path, 'a') as F:
+                F.create_dataset(stored_name, data=allowed_index)
+                F[stored_name].attrs['key'] = key
+            # writing to the file changes its modification time
+            memory_key = (self.h5path, tuple(os.stat(h5path).st_mtime_ns for h5path in _h5_files(self.h5path)), key)
 
-        return allowed_index
+        _ALLOWED_INDEX_TEMP[memory_key] = allowed_index
+        return allowed_index.copy()
 
     def load(self):
         allowed_index = self.load_allowed_index()
         with h5py.File(self.h5path) as F:  # ensure the file will be cleaned up
-            allowed_index_list = allowed_index.tolist()
-            spectra = np.array(F['spectra'])[allowed_index_list]
-            spectra_err = np.array(F['spectra_err'])[allowed_index_list]
-
-            y = np.array((spectra.shape[1]))
-            y_err = np.array((spectra.shape[1]))
-            for counter, tg in enumerate(self.target):
-                temp = np.array(F[f'{tg}'])[allowed_index_list]
-                if counter == 0:
-                    y = temp[:]
-                else:
-                    y = np.column_stack((y, temp[:]))
-                if self.load_err is True:
-                    temp_err = np.array(F[f'{tg}_err'])[allowed_index_list]
-                    if counter == 0:
-                        y_err = temp_err[:]
-                    else:
-                        y_err = np.column_stack((y_err, temp_err[:]))
+            if self.lazy is True:
+                spectra = H5LazyArray(self.h5path, 'spectra', allowed_index)
+                spectra_err = H5LazyArray(self.h5path, 'spectra_err', allowed_index)
+            else:
+                # only the rows needed are read, never the whole dataset
+                spectra = _read_rows(F['spectra'], allowed_index)
+                spectra_err = _read_rows(F['spectra_err'], allowed_index)
+
+            y = _read_labels(F, self.target)[allowed_index]
+            if self.load_err is True:
+                y_err = _read_labels(F, self.target, err=True)[allowed_index]
+
+        # single target is returned as 1D array
+        if self.target.shape[0] == 1:
+            y = y[:, 0]
+            if self.load_err is True:
+                y_err = y_err[:, 0]
 
         if self.load_err is True:
             return spectra, y, spectra_err, y_err
@@ -653,9 +816,151 @@ class H5Loader(object):
             2018-Feb-08 - Written - Henry Leung (University of Toronto)
         """
         allowed_index = self.load_allowed_index()
-        allowed_index_list = allowed_index.tolist()
         with h5py.File(self.h5path) as F:  # ensure the file will be cleaned up
-            return np.array(F[f'{name}'])[allowed_index_list]
+            if name not in F and ('labels' in F or 'labels_err' in F):
+                # the entry is a column of the labels matrix
+                err = name.endswith('_err') and 'labels_err' in F
+                return _read_labels(F, [name[:-4] if err else name], err=err)[allowed_index, 0]
+            return _read_rows(F[f'{name}'], allowed_index)
+
+
+class H5LazyArray(object):
+    """
+    Array-like of some rows of a dataset in a h5 file, rows are only read from the file when indexed. It can be indexed
+    like numpy array along the first axis and converted to numpy array with np.asarray(). The h5 file is opened on
+    first read in every process, so H5LazyArray can be pickled to other processes.
+
+    :param h5path: path to the h5 file
+    :type h5path: str
+    :param name: name of the dataset
+    :type name: str
+    :param rows: indices of rows of the dataset, the first axis of H5LazyArray
+    :type rows: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, h5path, name, rows):
+        self.h5path = h5path
+        self.name = name
+        self.rows = np.asarray(rows)
+        self._h5f = None
+        with h5py.File(self.h5path, 'r') as F:
+            self.shape = (self.rows.shape[0], *F[self.name].shape[1:])
+            self.dtype = np.float32 if F[self.name].dtype == np.float16 else F[self.name].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if self._h5f is None:
+            self._h5f = h5py.File(self.h5path, 'r')
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        data = _read_rows(self._h5f[self.name], self.rows[key])
+        return data[(slice(None),) + rest] if np.ndim(self.rows[key]) > 0 else data[rest]
+
+    def __array__(self, dtype=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+    def __getstate__(self):
+        # h5py file cannot be pickled, it will be opened again when needed
+        state = self.__dict__.copy()
+        state['_h5f'] = None
+        return state
+
+
+def _read_rows(dset, rows, max_gap=64, max_block=1024):
+    """
+    Read rows of a h5 dataset in blocks of nearby rows, so only the rows needed are in memory instead of reading the
+    whole dataset. Rows less than max_gap apart are read together as a contiguous block then discarded, which is
+    faster than reading every row separately.
+
+    :param dset: h5 dataset
+    :type dset: h5py.Dataset
+    :param rows: indices of rows, in any order
+    :type rows: Union[int, ndarray]
+    :param max_gap: rows with gap smaller than this are read in the same contiguous block
+    :type max_gap: int
+    :param max_block: maximum number of rows read in a block
+    :type max_block: int
+    :return: rows in the order of rows, half precision is upcasted to single precision
+    :rtype: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    if np.ndim(rows) == 0:
+        return _upcast(dset[int(rows)])
+    # sorted unique rows, inverse to give back rows in the requested order
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    out = np.empty((unique_rows.shape[0], *dset.shape[1:]), dtype=np.float32 if dset.dtype == np.float16 else
+                   dset.dtype)
+    if unique_rows.shape[0] == 0:
+        return out
+    # starting position in unique_rows of every block, a new block starts at a big gap or if the block is too long
+    new_block = np.diff(unique_rows) > max_gap
+    block_id = np.cumsum(np.concatenate([[0], new_block]))
+    block_first_row = unique_rows[np.concatenate([[0], np.nonzero(new_block)[0] + 1])]
+    block_id = block_id * (dset.shape[0] // max_block + 1) + (unique_rows - block_first_row[block_id]) // max_block
+    block_starts = np.concatenate([np.nonzero(np.diff(block_id))[0] + 1, [unique_rows.shape[0]]])
+    start = 0
+    for end in block_starts:
+        block_rows = unique_rows[start:end]
+        first, last = block_rows[0], block_rows[-1] + 1
+        if last - first == block_rows.shape[0]:
+            out[start:end] = dset[first:last]
+        else:
+            out[start:end] = dset[first:last][block_rows - first]
+        start = end
+    if np.array_equal(unique_rows, rows):
+        return out
+    return out[inverse]
+
+
+def _read_labels(h5f, names, err=False):
+    """
+    Read labels or their errors of every spectrum in a compiled h5 file as a 2D array, labels stored in the 2D
+    'labels' and 'labels_err' datasets are read with a single hyperslab of the columns needed
+
+    :param h5f: compiled h5 file
+    :type h5f: h5py.File
+    :param names: names of the labels
+    :type names: Union[list, ndarray]
+    :param err: True to read the errors of the labels
+    :type err: bool
+    :return: labels in the order of names with shape (number of spectra, number of labels)
+    :rtype: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    matrix_name = 'labels_err' if err is True else 'labels'
+    if matrix_name in h5f:
+        matrix_names = list(h5f[matrix_name].attrs['names'])
+        if all(name in matrix_names for name in names):
+            columns = np.array([matrix_names.index(name) for name in names])
+            first, last = columns.min(), columns.max() + 1
+            return h5f[matrix_name][:, first:last][:, columns - first]
+    suffix = '_err' if err is True else ''
+    labels = np.empty((h5f[f'{names[0]}{suffix}'].shape[0], len(names)), dtype=h5f[f'{names[0]}{suffix}'].dtype)
+    for counter, name in enumerate(names):
+        labels[:, counter] = h5f[f'{name}{suffix}'][()]
+    return labels
+
+
+def _upcast(array):
+    """
+    Convert half precision data stored in h5 file to single precision for neural network
+
+    :param array: data read from h5 file
+    :type array: ndarray
+    :return: data in at least single precision
+    :rtype: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    if array.dtype == np.float16:
+        return array.astype(np.float32)
+    else:
+        return array
 
 
 def target_conversion(target):
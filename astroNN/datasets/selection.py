@@ -0,0 +1,116 @@
+# ---------------------------------------------------------#
+#   astroNN.datasets.selection: select stars from catalogs
+# ---------------------------------------------------------#
+
+from collections import namedtuple
+
+import numpy as np
+
+_OPERATORS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '==': np.equal,
+              '!=': np.not_equal, 'in': np.isin}
+
+
+class Cut(namedtuple('Cut', ['column', 'op', 'value', 'index'])):
+    """
+    A cut on a column of a catalog, a star is selected if ``op(column[:, index], value)`` is True
+
+    :param column: name of the column
+    :type column: str
+    :param op: one of '<', '<=', '>', '>=', '==', '!=', 'in' or a function taking (column, value) and returning a
+               boolean array
+    :type op: Union[str, callable]
+    :param value: value to compare to
+    :type value: Union[float, int, str, tuple]
+    :param index: index of the column if it is a 2D column like PARAM or X_H, None for 1D column
+    :type index: Union[int, NoneType]
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    __slots__ = ()
+
+    def __new__(cls, column, op, value, index=None):
+        if isinstance(op, str) and op not in _OPERATORS:
+            raise ValueError(f"Unknown operator '{op}', only {list(_OPERATORS.keys())} or a function is accepted")
+        # list and array are not hashable, cuts need to be hashable to be memoised
+        if isinstance(value, (list, np.ndarray)):
+            value = tuple(np.asarray(value).tolist())
+        return super().__new__(cls, column, op, value, index)
+
+    def evaluate(self, catalog):
+        """
+        Evaluate the cut on a catalog
+
+        :param catalog: catalog with columns accessible by name, like astroNN.shared.catalog_cache.CatalogCache
+        :type catalog: Union[astroNN.shared.catalog_cache.CatalogCache, dict]
+        :return: boolean array, True for rows passing the cut
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        column = catalog[self.column]
+        if self.index is not None:
+            column = column[:, self.index]
+        op = self.op if callable(self.op) else _OPERATORS[self.op]
+        return np.asarray(op(column, self.value), dtype=bool)
+
+
+class StarSelection(object):
+    """
+    Select rows from a catalog with a list of Cut, the masks of every cut and every selection are memoised so
+    changing a single cut only evaluates that cut again
+
+    :param catalog: catalog with columns accessible by name, like astroNN.shared.catalog_cache.CatalogCache
+    :type catalog: Union[astroNN.shared.catalog_cache.CatalogCache, dict]
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._masks = {}
+        self._selections = {}
+
+    def cut_mask(self, cut):
+        """
+        Boolean mask of a single cut, memoised
+
+        :param cut: the cut
+        :type cut: Cut
+        :return: boolean array, True for rows passing the cut, do not modify it in place
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if cut not in self._masks:
+            self._masks[cut] = cut.evaluate(self.catalog)
+        return self._masks[cut]
+
+    def mask(self, cuts):
+        """
+        Boolean mask of all cuts combined
+
+        :param cuts: list of Cut
+        :type cuts: list
+        :return: boolean array, True for rows passing all cuts
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        cuts = list(cuts)
+        if len(cuts) == 0:
+            raise ValueError('At least one cut is required')
+        mask = self.cut_mask(cuts[0]).copy()
+        for cut in cuts[1:]:
+            # combine in place, no temporary array for every cut
+            np.logical_and(mask, self.cut_mask(cut), out=mask)
+        return mask
+
+    def select(self, cuts):
+        """
+        Indices of rows passing all cuts, memoised by the set of cuts
+
+        :param cuts: list of Cut
+        :type cuts: list
+        :return: sorted indices
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        key = frozenset(cuts)
+        if key not in self._selections:
+            self._selections[key] = np.nonzero(self.mask(cuts))[0]
+        return self._selections[key]
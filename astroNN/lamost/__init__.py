@@ -2,13 +2,17 @@ from .chips import wavelength_solution, pseudo_continuum
 from .lamost_shared import lamost_default_dr, lamost_env
 
 
-def load_allstar_dr5():
+def load_allstar_dr5(cache=False):
     """
     Open LAMOST DR5 allstar
 
-    :return: fits file opened by astropy
-    :rtype: astropy.io.fits.hdu.hdulist.HDUList
-    :History: 2018-Jun-17 - Written - Henry Leung (University of Toronto)
+    :param cache: True to get the columns of the catalog memory-mapped from astroNN catalog cache instead
+    :type cache: bool
+    :return: fits file opened by astropy, or the columns of the catalog if cache=True
+    :rtype: Union[astropy.io.fits.hdu.hdulist.HDUList, astroNN.shared.catalog_cache.CatalogCache]
+    :History:
+        | 2018-Jun-17 - Written - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
     import os
     from astropy.io import fits
@@ -17,4 +21,7 @@ def load_allstar_dr5():
     _lamost_dr5_allsta_path = os.path.join(lamost_env(), "DR5", file_name)
     if not os.path.isfile(_lamost_dr5_allsta_path):
         raise FileNotFoundError(f'{file_name} file not found')
+    if cache:
+        from astroNN.shared.catalog_cache import CatalogCache
+        return CatalogCache(_lamost_dr5_allsta_path)
     return fits.open(_lamost_dr5_allsta_path)
@@ -50,9 +50,11 @@ def Galaxy10CNN():
     HISTORY:
         2018-Feb-09 - Written - Henry Leung (University of Toronto)
         2018-Apr-02 - Update - Henry Leung (University of Toronto)
+        2026-Oct-16 - Update - Henry Leung (University of Toronto)
     """
     from astroNN.datasets.galaxy10 import galaxy10cls_lookup
     from astroNN.models.misc_models import Cifar10CNN
+    from astroNN.nn.utilities.augmentation import ImageFlipRotate
     galaxy10_net = Cifar10CNN()
     galaxy10_net._model_identifier = 'Galaxy10CNN'
     targetname = []
@@ -60,6 +62,8 @@ def Galaxy10CNN():
         targetname.extend([galaxy10cls_lookup(i)])
 
     galaxy10_net.targetname = targetname
+    # galaxy morphology does not depend on orientation
+    galaxy10_net.augment = ImageFlipRotate()
     return galaxy10_net
 
 
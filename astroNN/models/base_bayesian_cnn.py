@@ -3,6 +3,7 @@ import os
 import time
 import warnings
 from abc import ABC
+from functools import partial
 
 import numpy as np
 import tensorflow.keras as tfk
@@ -16,7 +17,7 @@ from astroNN.nn.losses import mean_absolute_error, mean_error
 from astroNN.nn.metrics import categorical_accuracy, binary_accuracy
 from astroNN.nn.numpy import sigmoid
 from astroNN.nn.utilities import Normalizer
-from astroNN.nn.utilities.generator import GeneratorMaster
+from astroNN.nn.utilities.generator import GeneratorMaster, LazyArray, PrefetchGenerator
 from astroNN.shared.custom_warnings import deprecated
 from astroNN.shared.nn_tools import gpu_availability
 from sklearn.model_selection import train_test_split
@@ -38,47 +39,37 @@ class BayesianCNNDataGenerator(GeneratorMaster):
     :type data: list
     :param manual_reset: Whether need to reset the generator manually, usually it is handled by tensorflow
     :type manual_reset: bool
+    :param indices: Indices of rows of data to use, None to use all rows
+    :type indices: Union[NoneType, ndarray]
+    :param sampler: 'random' to shuffle all rows or 'block' to shuffle blocks of contiguous rows
+    :type sampler: str
     :History:
         | 2017-Dec-02 - Written - Henry Leung (University of Toronto)
         | 2019-Feb-17 - Updated - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
 
-    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset=False):
+    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset=False, indices=None,
+                 sampler='random'):
         super().__init__(batch_size=batch_size, shuffle=shuffle, steps_per_epoch=steps_per_epoch, data=data,
-                         manual_reset=manual_reset)
+                         manual_reset=manual_reset, indices=indices, sampler=sampler)
         self.inputs = self.data[0]
         self.labels = self.data[1]
         self.input_err = self.data[2]
         self.labels_err = self.data[3]
 
-        # initial idx
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        self.current_idx = 0
-
     def _data_generation(self, inputs, labels, input_err, labels_err, idx_list_temp):
-        x = self.input_d_checking(inputs, idx_list_temp)
-        y = labels[idx_list_temp]
         x_err = self.input_d_checking(input_err, idx_list_temp)
+        x = self.augment_inputs(self.input_d_checking(inputs, idx_list_temp), idx_list_temp, x_err)
+        y = labels[idx_list_temp]
         y_err = labels_err[idx_list_temp]
         return x, y, x_err, y_err
 
-    def __getitem__(self, index):
-        x, y, x_err, y_err = self._data_generation(self.inputs,
-                                                   self.labels,
-                                                   self.input_err,
-                                                   self.labels_err,
-                                                   self.idx_list[self.current_idx:self.current_idx + self.batch_size])
-        self.current_idx += self.batch_size
-        if (self.current_idx+self.batch_size >= self.steps_per_epoch*self.batch_size-1) and self.manual_reset:
-            self.current_idx = 0
+    def _batch(self, idx_list_temp):
+        x, y, x_err, y_err = self._data_generation(self.inputs, self.labels, self.input_err, self.labels_err,
+                                                   idx_list_temp)
         return {'input': x, 'labels_err': y_err, 'input_err': x_err}, {'output': y, 'variance_output': y}
 
-    def on_epoch_end(self):
-        # shuffle the list when epoch ends for the next epoch
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        # reset counter
-        self.current_idx = 0
-
 
 class BayesianCNNPredDataGenerator(GeneratorMaster):
     """
@@ -103,30 +94,15 @@ class BayesianCNNPredDataGenerator(GeneratorMaster):
         self.inputs = self.data[0]
         self.input_err = self.data[1]
 
-        # initial idx
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        self.current_idx = 0
-
     def _data_generation(self, inputs, input_err, idx_list_temp):
         x = self.input_d_checking(inputs, idx_list_temp)
         x_err = self.input_d_checking(input_err, idx_list_temp)
         return x, x_err
 
-    def __getitem__(self, index):
-        x, x_err = self._data_generation(self.inputs,
-                                         self.input_err,
-                                         self.idx_list[self.current_idx:self.current_idx + self.batch_size])
-        self.current_idx += self.batch_size
-        if (self.current_idx+self.batch_size >= self.steps_per_epoch*self.batch_size-1) and self.manual_reset:
-            self.current_idx = 0
+    def _batch(self, idx_list_temp):
+        x, x_err = self._data_generation(self.inputs, self.input_err, idx_list_temp)
         return {'input': x, 'input_err': x_err}
 
-    def on_epoch_end(self):
-        # shuffle the list when epoch ends for the next epoch
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        # reset counter
-        self.current_idx = 0
-
 
 class BayesianCNNBase(NeuralNetMaster, ABC):
     """
@@ -156,6 +132,8 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         self.dropout_rate = 0.2
         self.length_scale = 3  # prior length scale
         self.mc_num = 100  # increased to 100 due to high performance VI on GPU implemented on 14 April 2018 (Henry)
+        self.mc_chunk_size = None  # number of MC draws per forward pass, None to draw all mc_num at once
+        self.mc_tol = None  # standard error of normalized predictions to stop MC draws of a data point, None to disable
         self.val_size = 0.1
         self.disable_dropout = False
 
@@ -167,25 +145,24 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
     def pre_training_checklist_child(self, input_data, labels, input_err, labels_err):
         self.pre_training_checklist_master(input_data, labels)
 
-        if isinstance(input_data, H5Loader):
-            self.targetname = input_data.target
-            input_data, labels = input_data.load()
-
         # check if exists (existing means the model has already been trained (e.g. fine-tuning), so we do not need calculate mean/std again)
         if self.input_normalizer is None:
             self.input_normalizer = Normalizer(mode=self.input_norm_mode)
             self.labels_normalizer = Normalizer(mode=self.labels_norm_mode)
 
-            norm_data = self.input_normalizer.normalize(input_data)
+            norm_data = self.normalize_data(self.input_normalizer, input_data)
             self.input_mean, self.input_std = self.input_normalizer.mean_labels, self.input_normalizer.std_labels
-            norm_labels = self.labels_normalizer.normalize(labels)
+            norm_labels = self.normalize_data(self.labels_normalizer, labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
-            norm_labels = self.labels_normalizer.normalize(labels, calc=False)
+            norm_data = self.normalize_data(self.input_normalizer, input_data, calc=False)
+            norm_labels = self.normalize_data(self.labels_normalizer, labels, calc=False)
 
         # No need to care about Magic number as loss function looks for magic num in y_true only
-        norm_input_err = input_err / self.input_std
+        if isinstance(input_err, np.ndarray):
+            norm_input_err = input_err / self.input_std
+        else:
+            norm_input_err = LazyArray(input_err, func=partial(np.multiply, 1. / self.input_std))
         norm_labels_err = labels_err / self.labels_std
 
         if self.keras_model is None:  # only compile if there is no keras_model, e.g. fine-tuning does not required
@@ -199,21 +176,25 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         self.training_generator = BayesianCNNDataGenerator(batch_size=self.batch_size,
                                                            shuffle=True,
                                                            steps_per_epoch=self.num_train // self.batch_size,
-                                                           data=[norm_data[self.train_idx],
-                                                                 norm_labels[self.train_idx],
-                                                                 norm_input_err[self.train_idx],
-                                                                 norm_labels_err[self.train_idx]],
-                                                           manual_reset=False)
+                                                           data=[norm_data, norm_labels, norm_input_err,
+                                                                 norm_labels_err],
+                                                           manual_reset=False,
+                                                           indices=self.train_idx,
+                                                           sampler=self.sampler)
+        self.training_generator.augment = self.augment
 
         val_batchsize = self.batch_size if len(self.val_idx) > self.batch_size else len(self.val_idx)
         self.validation_generator = BayesianCNNDataGenerator(batch_size=val_batchsize,
                                                              shuffle=False,
                                                              steps_per_epoch=max(self.val_num // self.batch_size, 1),
-                                                             data=[norm_data[self.val_idx],
-                                                                   norm_labels[self.val_idx],
-                                                                   norm_input_err[self.val_idx],
-                                                                   norm_labels_err[self.val_idx]],
-                                                           manual_reset=True)
+                                                             data=self.training_generator.data,
+                                                             manual_reset=True,
+                                                             indices=self.val_idx)
+
+        if isinstance(norm_data, LazyArray) and self.data_backend == 'sequence':
+            # data is read from disk, prepare batches in background so training does not wait for reading
+            self.training_generator = PrefetchGenerator(self.training_generator)
+            self.validation_generator = PrefetchGenerator(self.validation_generator)
 
         return norm_data, norm_labels, norm_input_err, norm_labels_err
 
@@ -273,16 +254,16 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
                                      sample_weight_mode=sample_weight_mode)
         return None
 
-    def train(self, input_data, labels, inputs_err=None, labels_err=None):
+    def train(self, input_data, labels=None, inputs_err=None, labels_err=None):
         """
         Train a Bayesian neural network
 
-        :param input_data: Data to be trained with neural network
-        :type input_data: ndarray
-        :param labels: Labels to be trained with neural network
-        :type labels: ndarray
+        :param input_data: Data to be trained with neural network, or H5Loader to stream data from h5 file
+        :type input_data: Union([ndarray, astroNN.datasets.H5Loader, astroNN.datasets.h5.H5LazyArray])
+        :param labels: Labels to be trained with neural network, not needed if input_data is H5Loader
+        :type labels: Union([NoneType, ndarray])
         :param inputs_err: Error for input_data (if any), same shape with input_data.
-        :type inputs_err: Union([NoneType, ndarray])
+        :type inputs_err: Union([NoneType, ndarray, astroNN.datasets.h5.H5LazyArray])
         :param labels_err: Labels error (if any)
         :type labels_err: Union([NoneType, ndarray])
         :return: None
@@ -290,9 +271,21 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         :History:
             | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
             | 2018-Apr-12 - Updated - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
         """
+        if isinstance(input_data, H5Loader):
+            # spectra stay on disk and are read batch by batch
+            self.targetname = input_data.target
+            input_data.lazy = True
+            input_data.load_err = True
+            input_data, labels, inputs_err, labels_err = input_data.load()
+
         if inputs_err is None:
-            inputs_err = np.zeros_like(input_data)
+            if isinstance(input_data, np.ndarray):
+                inputs_err = np.zeros_like(input_data)
+            else:
+                # zero-stride array so zeros do not take any memory
+                inputs_err = np.broadcast_to(np.zeros((), dtype=input_data.dtype), input_data.shape)
 
         if labels_err is None:
             labels_err = np.zeros_like(labels)
@@ -316,12 +309,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
 
         start_time = time.time()
 
-        self.history = self.keras_model.fit_generator(generator=self.training_generator,
-                                                      validation_data=self.validation_generator,
-                                                      epochs=self.max_epochs, verbose=self.verbose,
-                                                      workers=os.cpu_count(),
-                                                      callbacks=self.__callbacks,
-                                                      use_multiprocessing=MULTIPROCESS_FLAG)
+        self.history = self.fit_generators(self.__callbacks)
 
         print(f'Completed Training, {(time.time() - start_time):.{2}f}s in total')
 
@@ -365,7 +353,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             norm_labels = self.labels_normalizer.normalize(labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
+            norm_data = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
             norm_labels = self.labels_normalizer.normalize(labels, calc=False)
 
         # No need to care about Magic number as loss function looks for magic num in y_true only
@@ -429,6 +417,46 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         with open(self.fullfilepath + '/astroNN_model_parameter.json', 'w') as f:
             json.dump(data, f, indent=4, sort_keys=True)
 
+    def _mc_predict(self, mc_model, input_array, inputs_err, batch_size):
+        """
+        Run a FastMCInference model over all data in batches of batch_size
+
+        :return: array of mean and variance of the Monte Carlo draws of shape (data, outputs, 2)
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        total_test_num = input_array.shape[0]
+
+        # Due to the nature of how generator works, no overlapped prediction
+        data_gen_shape = (total_test_num // batch_size) * batch_size
+        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
+
+        # Data Generator for prediction
+        prediction_generator = BayesianCNNPredDataGenerator(batch_size=batch_size,
+                                                            shuffle=False,
+                                                            steps_per_epoch=data_gen_shape // batch_size,
+                                                            data=[input_array[:data_gen_shape],
+                                                                  inputs_err[:data_gen_shape]])
+
+        result = np.asarray(mc_model.predict_generator(prediction_generator))
+
+        if remainder_shape != 0:  # deal with remainder
+            remainder_generator = BayesianCNNPredDataGenerator(batch_size=remainder_shape,
+                                                               shuffle=False,
+                                                               steps_per_epoch=1,
+                                                               data=[input_array[data_gen_shape:],
+                                                                     inputs_err[data_gen_shape:]])
+            remainder_result = np.asarray(mc_model.predict_generator(remainder_generator))
+            if remainder_shape == 1:
+                remainder_result = np.expand_dims(remainder_result, axis=0)
+            result = np.concatenate((result, remainder_result))
+
+        # in case only 1 test data point, in such case we need to add a dimension
+        if result.ndim < 3 and batch_size == 1:
+            result = np.expand_dims(result, axis=0)
+
+        return result
+
     def test(self, input_data, inputs_err=None):
         """
         Test model, High performance version designed for fast variational inference on GPU
@@ -437,10 +465,11 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         :type input_data: ndarray
         :param inputs_err: Error for input_data, same shape with input_data.
         :type inputs_err: Union([NoneType, ndarray])
-        :return: prediction and prediction uncertainty
+        :return: prediction and prediction uncertainty, with number of Monte Carlo draws of each data point in 'mc_num'
         :History:
             | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
             | 2018-Apr-12 - Updated - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
         """
         self.has_model_check()
         if gpu_availability() is False and self.mc_num > 25:
@@ -454,20 +483,28 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
 
         input_data = np.atleast_2d(input_data)
 
-        if self.input_normalizer is not None:
-            input_array = self.input_normalizer.normalize(input_data, calc=False)
+        if self.fold_normalization is True:
+            # raw data and error are normalized by the model, predictions and variances are denormalized below as
+            # the model output mixes them
+            input_array = input_data
+            keras_model_predict = self.folded_model(self.keras_model_predict, denormalize=False)
+        elif self.input_normalizer is not None:
+            input_array = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
+            keras_model_predict = self.keras_model_predict
         else:
             # Prevent shallow copy issue
             input_array = np.array(input_data)
             input_array -= self.input_mean
             input_array /= self.input_std
+            keras_model_predict = self.keras_model_predict
 
         # if no error array then just zeros
         if inputs_err is None:
             inputs_err = np.zeros_like(input_data)
-        else:
+        elif self.fold_normalization is True:
             inputs_err = np.atleast_2d(inputs_err)
-            inputs_err /= self.input_std
+        else:
+            inputs_err = np.atleast_2d(inputs_err) / self.input_std
 
         total_test_num = input_data.shape[0]  # Number of testing data
 
@@ -477,38 +514,52 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         else:
             batch_size = self.batch_size
 
-        # Due to the nature of how generator works, no overlapped prediction
-        data_gen_shape = (total_test_num // batch_size) * batch_size
-        remainder_shape = total_test_num - data_gen_shape  # Remainder from generator
-
         start_time = time.time()
         print("Starting Dropout Variational Inference")
 
-        # Data Generator for prediction
-        prediction_generator = BayesianCNNPredDataGenerator(batch_size=batch_size,
-                                                            shuffle=False,
-                                                            steps_per_epoch=data_gen_shape // batch_size,
-                                                            data=[input_array[:data_gen_shape],
-                                                                  inputs_err[:data_gen_shape]])
-
-        new = FastMCInference(self.mc_num)(self.keras_model_predict)
-
-        result = np.asarray(new.predict_generator(prediction_generator))
-
-        if remainder_shape != 0:  # deal with remainder
-            remainder_generator = BayesianCNNPredDataGenerator(batch_size=remainder_shape,
-                                                               shuffle=False,
-                                                               steps_per_epoch=1,
-                                                               data=[input_array[data_gen_shape:],
-                                                                     inputs_err[data_gen_shape:]])
-            remainder_result = np.asarray(new.predict_generator(remainder_generator))
-            if remainder_shape == 1:
-                remainder_result = np.expand_dims(remainder_result, axis=0)
-            result = np.concatenate((result, remainder_result))
-
-        # in case only 1 test data point, in such case we need to add a dimension
-        if result.ndim < 3 and batch_size == 1:
-            result = np.expand_dims(result, axis=0)
+        if self.mc_chunk_size is not None:
+            mc_chunk_size = min(int(self.mc_chunk_size), self.mc_num)
+        elif self.mc_tol is not None:
+            mc_chunk_size = min(10, self.mc_num)  # rounds of 10 draws to check convergence
+        else:
+            mc_chunk_size = self.mc_num
+        if mc_chunk_size < 1:
+            raise AttributeError("mc_chunk_size cannot be smaller than 1")
+
+        # draw mc_chunk_size samples per forward pass so memory does not grow with mc_num, mean and variance of all
+        # draws are merged blockwise (Chan et al. 1979), result[..., 0] is the mean and result[..., 1] the variance.
+        # With mc_tol, only data points with standard error of mean predictions above mc_tol are drawn again, all
+        # data points still being drawn have the same number of draws mc_count
+        mc_models = {}
+        result, mc_count = None, 0
+        mc_counts = np.zeros(total_test_num, dtype=int)  # number of draws of each data point
+        active_idx = np.arange(total_test_num)
+        while mc_count < self.mc_num and active_idx.size > 0:
+            mc_block = min(mc_chunk_size, self.mc_num - mc_count)
+            if mc_block not in mc_models:
+                mc_models[mc_block] = FastMCInference(mc_block)(keras_model_predict)
+            if active_idx.size == total_test_num:
+                block_result = self._mc_predict(mc_models[mc_block], input_array, inputs_err, batch_size)
+            else:
+                block_result = self._mc_predict(mc_models[mc_block], input_array[active_idx],
+                                                inputs_err[active_idx], min(batch_size, active_idx.size))
+            if result is None:
+                result = block_result
+            else:
+                total_count = mc_count + mc_block
+                active_result = result[active_idx]
+                delta = block_result[..., 0] - active_result[..., 0]
+                active_result[..., 1] = (active_result[..., 1] * mc_count + block_result[..., 1] * mc_block +
+                                         delta ** 2 * mc_count * mc_block / total_count) / total_count
+                active_result[..., 0] += delta * mc_block / total_count
+                result[active_idx] = active_result
+            mc_count += mc_block
+            mc_counts[active_idx] = mc_count
+
+            if self.mc_tol is not None and mc_count > 1:
+                half_first_dim = result.shape[1] // 2
+                std_err = np.sqrt(result[active_idx, :half_first_dim, 1] / mc_count)
+                active_idx = active_idx[np.any(std_err > self.mc_tol, axis=1)]
 
         half_first_dim = result.shape[1] // 2  # result.shape[1] is guarantee an even number, otherwise sth is wrong
 
@@ -516,11 +567,11 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         mc_dropout_uncertainty = result[:, :half_first_dim, 1] * (self.labels_std ** 2)  # model uncertainty
         predictions_var = np.exp(result[:, half_first_dim:, 0]) * (self.labels_std ** 2)  # predictive uncertainty
 
-        print(f'Completed Dropout Variational Inference with {self.mc_num} forward passes, '
+        print(f'Completed Dropout Variational Inference with {np.mean(mc_counts):.{1}f} forward passes on average, '
               f'{(time.time() - start_time):.{2}f}s elapsed')
 
         if self.labels_normalizer is not None:
-            predictions = self.labels_normalizer.denormalize(predictions)
+            predictions = self.labels_normalizer.denormalize(predictions, out=predictions)
         else:
             predictions *= self.labels_std
             predictions += self.labels_mean
@@ -563,7 +614,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             raise AttributeError('Unknown Task')
 
         return predictions, {'total': pred_uncertainty, 'model': mc_dropout_uncertainty,
-                             'predictive': predictive_uncertainty}
+                             'predictive': predictive_uncertainty, 'mc_num': mc_counts}
 
     @deprecated
     def test_old(self, input_data, inputs_err=None):
@@ -580,7 +631,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         self.pre_testing_checklist_master()
 
         if self.input_normalizer is not None:
-            input_array = self.input_normalizer.normalize(input_data, calc=False)
+            input_array = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
         else:
             # Prevent shallow copy issue
             input_array = np.array(input_data)
@@ -647,7 +698,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
         print(f'Completed Dropout Variational Inference, {(time.time() - start_time):.{2}f}s in total')
 
         if self.labels_normalizer is not None:
-            predictions = self.labels_normalizer.denormalize(predictions)
+            predictions = self.labels_normalizer.denormalize(predictions, out=predictions)
         else:
             predictions *= self.labels_std
             predictions += self.labels_mean
@@ -723,7 +774,7 @@ class BayesianCNNBase(NeuralNetMaster, ABC):
             norm_labels = self.labels_normalizer.normalize(labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
+            norm_data = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
             norm_labels = self.labels_normalizer.normalize(labels, calc=False)
 
         # No need to care about Magic number as loss function looks for magic num in y_true only
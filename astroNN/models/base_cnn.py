@@ -7,13 +7,14 @@ import numpy as np
 import tensorflow.keras as tfk
 from astroNN.config import MULTIPROCESS_FLAG
 from astroNN.config import _astroNN_MODEL_NAME
+from astroNN.datasets import H5Loader
 from astroNN.models.base_master_nn import NeuralNetMaster
 from astroNN.nn.callbacks import VirutalCSVLogger
 from astroNN.nn.losses import categorical_crossentropy, binary_crossentropy
 from astroNN.nn.losses import mean_squared_error, mean_absolute_error, mean_error
 from astroNN.nn.metrics import categorical_accuracy, binary_accuracy
 from astroNN.nn.utilities import Normalizer
-from astroNN.nn.utilities.generator import GeneratorMaster
+from astroNN.nn.utilities.generator import GeneratorMaster, LazyArray, PrefetchGenerator
 from sklearn.model_selection import train_test_split
 
 regularizers = tfk.regularizers
@@ -33,40 +34,30 @@ class CNNDataGenerator(GeneratorMaster):
     :type data: list
     :param manual_reset: Whether need to reset the generator manually, usually it is handled by tensorflow
     :type manual_reset: bool
+    :param indices: Indices of rows of data to use, None to use all rows
+    :type indices: Union[NoneType, ndarray]
+    :param sampler: 'random' to shuffle all rows or 'block' to shuffle blocks of contiguous rows
+    :type sampler: str
     :History:
         | 2017-Dec-02 - Written - Henry Leung (University of Toronto)
         | 2019-Feb-17 - Updated - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
 
-    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset=False):
+    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset=False, indices=None,
+                 sampler='random'):
         super().__init__(batch_size=batch_size, shuffle=shuffle, steps_per_epoch=steps_per_epoch, data=data,
-                         manual_reset=manual_reset)
+                         manual_reset=manual_reset, indices=indices, sampler=sampler)
         self.inputs = self.data[0]
         self.labels = self.data[1]
 
-        # initial idx
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        self.current_idx = 0
-
     def _data_generation(self, inputs, labels, idx_list_temp):
-        x = self.input_d_checking(inputs, idx_list_temp)
+        x = self.augment_inputs(self.input_d_checking(inputs, idx_list_temp), idx_list_temp)
         y = labels[idx_list_temp]
         return x, y
 
-    def __getitem__(self, index):
-        x, y = self._data_generation(self.inputs,
-                                     self.labels,
-                                     self.idx_list[self.current_idx:self.current_idx + self.batch_size])
-        self.current_idx += self.batch_size
-        if (self.current_idx+self.batch_size >= self.steps_per_epoch*self.batch_size-1) and self.manual_reset:
-            self.current_idx = 0
-        return x, y
-
-    def on_epoch_end(self):
-        # shuffle the list when epoch ends for the next epoch
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        # reset counter
-        self.current_idx = 0
+    def _batch(self, idx_list_temp):
+        return self._data_generation(self.inputs, self.labels, idx_list_temp)
 
 
 class CNNPredDataGenerator(GeneratorMaster):
@@ -91,27 +82,13 @@ class CNNPredDataGenerator(GeneratorMaster):
                          manual_reset=manual_reset)
         self.inputs = self.data[0]
 
-        # initial idx
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        self.current_idx = 0
-
     def _data_generation(self, inputs, idx_list_temp):
         # Generate data
         x = self.input_d_checking(inputs, idx_list_temp)
         return x
 
-    def __getitem__(self, index):
-        x = self._data_generation(self.inputs, self.idx_list[self.current_idx:self.current_idx + self.batch_size])
-        self.current_idx += self.batch_size
-        if (self.current_idx+self.batch_size >= self.steps_per_epoch*self.batch_size-1) and self.manual_reset:
-            self.current_idx = 0
-        return x
-
-    def on_epoch_end(self):
-        # shuffle the list when epoch ends for the next epoch
-        self.idx_list = self._get_exploration_order(range(self.inputs.shape[0]))
-        # reset counter
-        self.current_idx = 0
+    def _batch(self, idx_list_temp):
+        return self._data_generation(self.inputs, idx_list_temp)
 
 
 class CNNBase(NeuralNetMaster, ABC):
@@ -200,13 +177,13 @@ class CNNBase(NeuralNetMaster, ABC):
             self.input_normalizer = Normalizer(mode=self.input_norm_mode)
             self.labels_normalizer = Normalizer(mode=self.labels_norm_mode)
 
-            norm_data = self.input_normalizer.normalize(input_data)
+            norm_data = self.normalize_data(self.input_normalizer, input_data)
             self.input_mean, self.input_std = self.input_normalizer.mean_labels, self.input_normalizer.std_labels
-            norm_labels = self.labels_normalizer.normalize(labels)
+            norm_labels = self.normalize_data(self.labels_normalizer, labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
-            norm_labels = self.labels_normalizer.normalize(labels, calc=False)
+            norm_data = self.normalize_data(self.input_normalizer, input_data, calc=False)
+            norm_labels = self.normalize_data(self.labels_normalizer, labels, calc=False)
 
         if self.keras_model is None:  # only compile if there is no keras_model, e.g. fine-tuning does not required
             self.compile()
@@ -218,31 +195,49 @@ class CNNBase(NeuralNetMaster, ABC):
             batch_size=self.batch_size,
             shuffle=True,
             steps_per_epoch=self.num_train // self.batch_size,
-            data=[norm_data[self.train_idx], norm_labels[self.train_idx]],
-            manual_reset=False)
+            data=[norm_data, norm_labels],
+            manual_reset=False,
+            indices=self.train_idx,
+            sampler=self.sampler)
+        self.training_generator.augment = self.augment
 
         val_batchsize = self.batch_size if len(self.val_idx) > self.batch_size else len(self.val_idx)
         self.validation_generator = CNNDataGenerator(
             batch_size=val_batchsize,
             shuffle=False,
             steps_per_epoch=max(self.val_num // self.batch_size, 1),
-            data=[norm_data[self.val_idx], norm_labels[self.val_idx]],
-            manual_reset=True)
+            data=self.training_generator.data,
+            manual_reset=True,
+            indices=self.val_idx)
+
+        if isinstance(norm_data, LazyArray) and self.data_backend == 'sequence':
+            # data is read from disk, prepare batches in background so training does not wait for reading
+            self.training_generator = PrefetchGenerator(self.training_generator)
+            self.validation_generator = PrefetchGenerator(self.validation_generator)
 
         return input_data, labels
 
-    def train(self, input_data, labels):
+    def train(self, input_data, labels=None):
         """
         Train a Convolutional neural network
 
-        :param input_data: Data to be trained with neural network
-        :type input_data: ndarray
-        :param labels: Labels to be trained with neural network
-        :type labels: ndarray
+        :param input_data: Data to be trained with neural network, or H5Loader to stream data from h5 file
+        :type input_data: Union([ndarray, astroNN.datasets.H5Loader, astroNN.datasets.h5.H5LazyArray])
+        :param labels: Labels to be trained with neural network, not needed if input_data is H5Loader
+        :type labels: Union([NoneType, ndarray])
         :return: None
         :rtype: NoneType
-        :History: 2017-Dec-06 - Written - Henry Leung (University of Toronto)
+        :History:
+            | 2017-Dec-06 - Written - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
         """
+        if isinstance(input_data, H5Loader):
+            # spectra stay on disk and are read batch by batch
+            self.targetname = input_data.target
+            input_data.lazy = True
+            input_data.load_err = False
+            input_data, labels = input_data.load()
+
         # Call the checklist to create astroNN folder and save parameters
         self.pre_training_checklist_child(input_data, labels)
 
@@ -266,12 +261,7 @@ class CNNBase(NeuralNetMaster, ABC):
 
         start_time = time.time()
 
-        self.history = self.keras_model.fit_generator(generator=self.training_generator,
-                                                      validation_data=self.validation_generator,
-                                                      epochs=self.max_epochs, verbose=self.verbose,
-                                                      workers=os.cpu_count(),
-                                                      callbacks=self.__callbacks,
-                                                      use_multiprocessing=MULTIPROCESS_FLAG)
+        self.history = self.fit_generators(self.__callbacks)
 
         print(f'Completed Training, {(time.time() - start_time):.{2}f}s in total')
 
@@ -304,7 +294,7 @@ class CNNBase(NeuralNetMaster, ABC):
             norm_labels = self.labels_normalizer.normalize(labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
+            norm_data = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
             norm_labels = self.labels_normalizer.normalize(labels, calc=False)
 
         start_time = time.time()
@@ -367,20 +357,28 @@ class CNNBase(NeuralNetMaster, ABC):
         :type input_data: ndarray
         :return: prediction and prediction uncertainty
         :rtype: ndarry
-        :History: 2017-Dec-06 - Written - Henry Leung (University of Toronto)
+        :History:
+            | 2017-Dec-06 - Written - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
         """
         self.has_model_check()
         self.pre_testing_checklist_master()
 
         input_data = np.atleast_2d(input_data)
 
-        if self.input_normalizer is not None:
-            input_array = self.input_normalizer.normalize(input_data, calc=False)
+        if self.fold_normalization is True:
+            # raw data is normalized and predictions are denormalized by the model
+            input_array = input_data
+            keras_model = self.folded_model()
+        elif self.input_normalizer is not None:
+            input_array = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
+            keras_model = self.keras_model
         else:
             # Prevent shallow copy issue
             input_array = np.array(input_data)
             input_array -= self.input_mean
             input_array /= self.input_std
+            keras_model = self.keras_model
 
         total_test_num = input_data.shape[0]  # Number of testing data
 
@@ -402,21 +400,23 @@ class CNNBase(NeuralNetMaster, ABC):
                                                     shuffle=False,
                                                     steps_per_epoch=input_array.shape[0] // self.batch_size,
                                                     data=[input_array[:data_gen_shape]])
-        predictions[:data_gen_shape] = np.asarray(self.keras_model.predict_generator(prediction_generator))
+        predictions[:data_gen_shape] = np.asarray(keras_model.predict_generator(prediction_generator))
 
         if remainder_shape != 0:
             remainder_data = input_array[data_gen_shape:]
             # assume its caused by mono images, so need to expand dim by 1
             if len(input_array[0].shape) != len(self._input_shape):
                 remainder_data = np.expand_dims(remainder_data, axis=-1)
-            result = self.keras_model.predict(remainder_data)
+            result = keras_model.predict(remainder_data)
             predictions[data_gen_shape:] = result.reshape((remainder_shape, self._labels_shape))
 
-        if self.labels_normalizer is not None:
-            predictions = self.labels_normalizer.denormalize(predictions)
-        else:
-            predictions *= self.labels_std
-            predictions += self.labels_mean
+        # predictions of folded model are already denormalized
+        if self.fold_normalization is False:
+            if self.labels_normalizer is not None:
+                predictions = self.labels_normalizer.denormalize(predictions, out=predictions)
+            else:
+                predictions *= self.labels_std
+                predictions += self.labels_mean
 
         print(f'Completed Inference, {(time.time() - start_time):.{2}f}s elapsed')
 
@@ -445,7 +445,7 @@ class CNNBase(NeuralNetMaster, ABC):
             norm_labels = self.labels_normalizer.normalize(labels)
             self.labels_mean, self.labels_std = self.labels_normalizer.mean_labels, self.labels_normalizer.std_labels
         else:
-            norm_data = self.input_normalizer.normalize(input_data, calc=False)
+            norm_data = self.input_normalizer.normalize(input_data, calc=False, dtype=np.float32)
             norm_labels = self.labels_normalizer.normalize(labels, calc=False)
 
         eval_batchsize = self.batch_size if input_data.shape[0] > self.batch_size else input_data.shape[0]
@@ -6,6 +6,7 @@ import sys
 import time
 import warnings
 from abc import ABC, abstractmethod
+from functools import partial
 
 import numpy as np
 import pylab as plt
@@ -14,8 +15,11 @@ import tensorflow.keras as tfk
 from packaging import version
 
 import astroNN
+from astroNN.config import MULTIPROCESS_FLAG
 from astroNN.config import _astroNN_MODEL_NAME
 from astroNN.config import cpu_gpu_check
+from astroNN.nn.layers import Normalize
+from astroNN.nn.utilities.generator import LazyArray, PrefetchGenerator
 from astroNN.shared.custom_warnings import deprecated
 from astroNN.shared.nn_tools import folder_runnum
 
@@ -40,6 +44,11 @@ class NeuralNetMaster(ABC):
     :ivar fullfilepath: Full file path
     :ivar batch_size: Batch size for training, by default 64
     :ivar autosave: Boolean to flag whether autosave model or not
+    :ivar data_backend: Data pipeline for training, 'sequence' for keras Sequence or 'tf.data' for tf.data.Dataset
+    :ivar cache_data: Only for 'tf.data', True to cache batches in memory or filename to cache to a file
+    :ivar sampler: Order of training data, 'random' to shuffle all rows or 'block' to shuffle blocks of contiguous rows
+    :ivar augment: Augmenter or list of augmenters from astroNN.nn.utilities.augmentation for training inputs
+    :ivar fold_normalization: True to normalize inputs and denormalize outputs inside the keras model at inference
 
     :ivar task: Task
     :ivar lr: Learning rate
@@ -57,6 +66,7 @@ class NeuralNetMaster(ABC):
     :History:
         | 2017-Dec-23 - Written - Henry Leung (University of Toronto)
         | 2018-Jan-05 - Updated - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
 
     def __init__(self):
@@ -73,6 +83,11 @@ class NeuralNetMaster(ABC):
         self.fullfilepath = None
         self.batch_size = 64
         self.autosave = False
+        self.data_backend = 'sequence'  # 'sequence' for keras Sequence or 'tf.data' for tf.data.Dataset
+        self.cache_data = False  # Only for 'tf.data', True to cache batches in memory or filename to cache to a file
+        self.sampler = 'random'  # 'random' to shuffle all rows or 'block' to shuffle blocks of contiguous rows
+        self.augment = None  # augmenter or list of augmenters for training inputs, None for no augmentation
+        self.fold_normalization = False  # True to normalize and denormalize inside the keras model at inference
 
         # Hyperparameter
         self.task = None
@@ -169,6 +184,106 @@ class NeuralNetMaster(ABC):
     def post_training_checklist_child(self):
         raise NotImplementedError
 
+    @staticmethod
+    def normalize_data(normalizer, data, calc=True, chunk_size=None):
+        """
+        Normalize data, if data is not a numpy array (e.g. spectra from H5Loader with lazy=True), it will be normalized
+        batch by batch when indexed instead
+
+        :param normalizer: normalizer
+        :type normalizer: astroNN.nn.utilities.normalizer.Normalizer
+        :param data: data to be normalized
+        :type data: Union[ndarray, astroNN.datasets.h5.H5LazyArray, astroNN.nn.utilities.generator.LazyArray]
+        :param calc: True to calculate mean and standard derivation of normalizer from data
+        :type calc: bool
+        :param chunk_size: number of rows read at once to calculate mean and standard derivation if data is lazy
+        :type chunk_size: Union[NoneType, int]
+        :return: normalized data
+        :rtype: Union[ndarray, astroNN.nn.utilities.generator.LazyArray]
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if isinstance(data, np.ndarray):
+            return normalizer.normalize(data, calc=calc)
+        if calc is True:
+            # mean and standard derivation are accumulated chunk by chunk without loading all data
+            normalizer.fit(data, chunk_size=chunk_size)
+        return LazyArray(data, func=partial(normalizer.normalize, calc=False))
+
+    def folded_model(self, model=None, denormalize=True):
+        """
+        | Keras model taking raw inputs and returning denormalized outputs in one graph execution, normalization is
+        | done by non-trainable ``Normalize`` layers before and after the model and MAGIC_NUMBER is passed through.
+        | Input 'input' is normalized with input_mean and input_std, 'input_err' and 'labels_err' are divided by
+        | input_std and labels_std, the output named 'output' (or the only output) is denormalized.
+        | It can be saved by keras as a standalone model with ``custom_objects={'Normalize': Normalize}``.
+
+        :param model: keras model, None to use keras_model
+        :type model: Union[NoneType, tf.keras.Model]
+        :param denormalize: True to denormalize the output, False to only normalize inputs
+        :type denormalize: bool
+        :return: keras model with normalization
+        :rtype: tf.keras.Model
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        self.has_model_check()
+        if '3s' in [str(self.input_norm_mode), str(self.labels_norm_mode)]:
+            raise ValueError("Normalization mode '3s' uses a custom function which cannot be folded into the model")
+        model = self.keras_model if model is None else model
+
+        raw_inputs, norm_inputs = [], []
+        for name, input_tensor in zip(model.input_names, model.inputs):
+            raw_input = tfk.layers.Input(shape=input_tensor.shape[1:], name=name)
+            if name == 'input_err':
+                norm_inputs.append(Normalize(mean=0., std=self.input_std, name=f'{name}_norm')(raw_input))
+            elif name == 'labels_err':
+                norm_inputs.append(Normalize(mean=0., std=self.labels_std, name=f'{name}_norm')(raw_input))
+            else:
+                norm_inputs.append(Normalize(mean=self.input_mean, std=self.input_std, name=f'{name}_norm')(raw_input))
+            raw_inputs.append(raw_input)
+
+        outputs = model(norm_inputs if len(norm_inputs) > 1 else norm_inputs[0])
+        if denormalize is True:
+            output_names = model.output_names
+            outputs = [Normalize(mean=self.labels_mean, std=self.labels_std, inverse=True, name=f'{name}_denorm')(output)
+                       if name == 'output' or len(output_names) == 1 else output
+                       for name, output in zip(output_names, tf.nest.flatten(outputs))]
+            outputs = outputs if len(outputs) > 1 else outputs[0]
+        return tfk.Model(inputs=raw_inputs, outputs=outputs, name=f'{model.name}_folded')
+
+    def fit_generators(self, callbacks):
+        """
+        Train keras_model with training_generator and validation_generator using the pipeline set by data_backend
+
+        :param callbacks: keras callbacks
+        :type callbacks: list
+        :return: keras training history
+        :rtype: tf.keras.callbacks.History
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if self.data_backend == 'tf.data':
+            # batching and prefetching are done by tensorflow, no python worker is needed
+            cache = self.cache_data
+            return self.keras_model.fit(
+                self.training_generator.to_dataset(cache=cache if isinstance(cache, bool) else f'{cache}_train'),
+                validation_data=self.validation_generator.to_dataset(
+                    cache=cache if isinstance(cache, bool) else f'{cache}_val'),
+                epochs=self.max_epochs, verbose=self.verbose, callbacks=callbacks)
+        elif self.data_backend == 'sequence':
+            prefetch = isinstance(self.training_generator, PrefetchGenerator)
+            # batches are already prepared in background thread by PrefetchGenerator
+            history = self.keras_model.fit_generator(generator=self.training_generator,
+                                                     validation_data=self.validation_generator,
+                                                     epochs=self.max_epochs, verbose=self.verbose,
+                                                     workers=0 if prefetch else os.cpu_count(),
+                                                     callbacks=callbacks,
+                                                     use_multiprocessing=False if prefetch else MULTIPROCESS_FLAG)
+            if prefetch:
+                self.training_generator.close()
+                self.validation_generator.close()
+            return history
+        else:
+            raise ValueError(f"Unknown data_backend '{self.data_backend}', only 'sequence' or 'tf.data' is accepted")
+
     def pre_training_checklist_master(self, input_data, labels):
         if self.val_size is None:
             self.val_size = 0
@@ -301,6 +416,43 @@ class NeuralNetMaster(ABC):
                           UserWarning)
             pass
 
+    def _gradient_tensors(self, x, denormalize=False):
+        """
+        Input data, input and output tensors and their shapes to differentiate, from keras_model_predict if exists.
+        If fold_normalization is True, tensors are from folded_model() so raw x is used and derivatives are with
+        respect to raw input, output is denormalized only if denormalize is True
+
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        model = self.keras_model_predict if self.keras_model_predict is not None else self.keras_model
+        try:
+            if self.fold_normalization is True:
+                output_model = tfk.Model(inputs=model.get_layer("input").input,
+                                         outputs=model.get_layer("output").output)
+                model = self.folded_model(output_model, denormalize=denormalize)
+                output_tens = model.output
+                output_shape_expectation = model.output_shape
+            else:
+                output_tens = model.get_layer("output").output
+                output_shape_expectation = model.get_layer("output").output_shape
+            input_tens = model.get_layer("input").input
+            input_shape_expectation = model.get_layer("input").input_shape
+        except ValueError:
+            raise ValueError("astroNN expects input layer is named as 'input' and output layer is named as 'output', "
+                             "but None is found.")
+
+        if self.fold_normalization is True:
+            x_data = np.array(x, dtype=np.float32)
+        elif self.input_normalizer is not None:
+            x_data = self.input_normalizer.normalize(x, calc=False, dtype=np.float32)
+        else:
+            # Prevent shallow copy issue
+            x_data = np.array(x)
+            x_data -= self.input_mean
+            x_data /= self.input_std
+
+        return x_data, input_tens, output_tens, input_shape_expectation, output_shape_expectation
+
     def hessian(self, x=None, mean_output=False, mc_num=1, denormalize=False, method='exact'):
         """
         | Calculate the hessian of output to input
@@ -346,28 +498,8 @@ class NeuralNetMaster(ABC):
             if mc_num < 1 or isinstance(mc_num, float):
                 raise ValueError('mc_num must be a positive integer')
 
-            if self.input_normalizer is not None:
-                x_data = self.input_normalizer.normalize(x, calc=False)
-            else:
-                # Prevent shallow copy issue
-                x_data = np.array(x)
-                x_data -= self.input_mean
-                x_data /= self.input_std
-
-            try:
-                input_tens = self.keras_model_predict.get_layer("input").input
-                output_tens = self.keras_model_predict.get_layer("output").output
-                input_shape_expectation = self.keras_model_predict.get_layer("input").input_shape
-                output_shape_expectation = self.keras_model_predict.get_layer("output").output_shape
-            except AttributeError:
-                input_tens = self.keras_model.get_layer("input").input
-                output_tens = self.keras_model.get_layer("output").output
-                input_shape_expectation = self.keras_model.get_layer("input").input_shape
-                output_shape_expectation = self.keras_model.get_layer("output").output_shape
-            except ValueError:
-                raise ValueError(
-                    "astroNN expects input layer is named as 'input' and output layer is named as 'output', "
-                    "but None is found.")
+            x_data, input_tens, output_tens, input_shape_expectation, output_shape_expectation = \
+                self._gradient_tensors(x, denormalize=denormalize)
 
             if len(input_shape_expectation) == 1:
                 input_shape_expectation = input_shape_expectation[0]
@@ -423,7 +555,9 @@ class NeuralNetMaster(ABC):
 
             hessians_master = np.squeeze(hessians_master)
 
-            if denormalize:  # no need to denorm input scaling because of we assume first order dependence
+            # folded model is already differentiated in physical units
+            if denormalize and self.fold_normalization is False:
+                # no need to denorm input scaling because of we assume first order dependence
                 if self.labels_std is not None:
                     try:
                         hessians_master = hessians_master * self.labels_std
@@ -464,27 +598,8 @@ class NeuralNetMaster(ABC):
         if mc_num < 1 or isinstance(mc_num, float):
             raise ValueError('mc_num must be a positive integer')
 
-        if self.input_normalizer is not None:
-            x_data = self.input_normalizer.normalize(x, calc=False)
-        else:
-            # Prevent shallow copy issue
-            x_data = np.array(x)
-            x_data -= self.input_mean
-            x_data /= self.input_std
-
-        try:
-            input_tens = self.keras_model_predict.get_layer("input").input
-            output_tens = self.keras_model_predict.get_layer("output").output
-            input_shape_expectation = self.keras_model_predict.get_layer("input").input_shape
-            output_shape_expectation = self.keras_model_predict.get_layer("output").output_shape
-        except AttributeError:
-            input_tens = self.keras_model.get_layer("input").input
-            output_tens = self.keras_model.get_layer("output").output
-            input_shape_expectation = self.keras_model.get_layer("input").input_shape
-            output_shape_expectation = self.keras_model.get_layer("output").output_shape
-        except ValueError:
-            raise ValueError("astroNN expects input layer is named as 'input' and output layer is named as 'output', "
-                             "but None is found.")
+        x_data, input_tens, output_tens, input_shape_expectation, output_shape_expectation = \
+            self._gradient_tensors(x, denormalize=denormalize)
 
         if len(input_shape_expectation) == 1:
             input_shape_expectation = input_shape_expectation[0]
@@ -537,7 +652,9 @@ class NeuralNetMaster(ABC):
 
         hessians_diag_master = np.squeeze(hessians_diag_master)
 
-        if denormalize:  # no need to denorm input scaling because of we assume first order dependence
+        # folded model is already differentiated in physical units
+        if denormalize and self.fold_normalization is False:
+            # no need to denorm input scaling because of we assume first order dependence
             if self.labels_std is not None:
                 try:
                     hessians_diag_master = hessians_diag_master * self.labels_std
@@ -576,27 +693,8 @@ class NeuralNetMaster(ABC):
         if mc_num < 1 or isinstance(mc_num, float):
             raise ValueError('mc_num must be a positive integer')
 
-        if self.input_normalizer is not None:
-            x_data = self.input_normalizer.normalize(x, calc=False)
-        else:
-            # Prevent shallow copy issue
-            x_data = np.array(x)
-            x_data -= self.input_mean
-            x_data /= self.input_std
-
-        try:
-            input_tens = self.keras_model_predict.get_layer("input").input
-            output_tens = self.keras_model_predict.get_layer("output").output
-            input_shape_expectation = self.keras_model_predict.get_layer("input").input_shape
-            output_shape_expectation = self.keras_model_predict.get_layer("output").output_shape
-        except AttributeError:
-            input_tens = self.keras_model.get_layer("input").input
-            output_tens = self.keras_model.get_layer("output").output
-            input_shape_expectation = self.keras_model.get_layer("input").input_shape
-            output_shape_expectation = self.keras_model.get_layer("output").output_shape
-        except ValueError:
-            raise ValueError("astroNN expects input layer is named as 'input' and output layer is named as 'output', "
-                             "but None is found.")
+        x_data, input_tens, output_tens, input_shape_expectation, output_shape_expectation = \
+            self._gradient_tensors(x, denormalize=denormalize)
 
         if len(input_shape_expectation) == 1:
             input_shape_expectation = input_shape_expectation[0]
@@ -646,7 +744,8 @@ class NeuralNetMaster(ABC):
 
         jacobian_master = np.squeeze(jacobian_master)
 
-        if denormalize:
+        # folded model is already differentiated in physical units
+        if denormalize and self.fold_normalization is False:
             if self.input_std is not None:
                 jacobian_master = jacobian_master / np.squeeze(self.input_std)
 
@@ -681,7 +780,7 @@ class NeuralNetMaster(ABC):
             raise ValueError('Please provide data to calculate the jacobian')
 
         if self.input_normalizer is not None:
-            x_data = self.input_normalizer.normalize(x, calc=False)
+            x_data = self.input_normalizer.normalize(x, calc=False, dtype=np.float32)
         else:
             # Prevent shallow copy issue
             x_data = np.array(x)
@@ -1,9 +1,11 @@
 import math
+import numpy as np
 import tensorflow as tf
 import tensorflow.keras as tfk
 from packaging import version
 from tensorflow.python.framework import tensor_shape
 
+from astroNN.config import MAGIC_NUMBER
 from astroNN.nn import intpow_avx2
 
 from tensorflow_probability.python import distributions as tfd
@@ -439,17 +441,86 @@ class ErrorProp(Layer):
 
 class FastMCInference():
     """
-    Turn a model for fast Monte Carlo (Dropout, Flipout, etc) Inference on GPU
+    | Turn a model for fast Monte Carlo (Dropout, Flipout, etc) Inference on GPU
+    |
+    | Layers before the first stochastic layer (MCDropout, MCGaussianDropout, MCConcreteDropout, MCBatchNorm, ErrorProp)
+    | are deterministic, so by default they are run once per batch and only their outputs are repeated n times through
+    | the rest of the model
 
     :param n: Number of Monte Carlo integration
     :type n: int
+    :param deterministic_prefix: True to run layers before the first stochastic layer only once
+    :type deterministic_prefix: bool
     :return: A layer
     :rtype: object
-    :History: 2018-Apr-13 - Written - Henry Leung (University of Toronto)
+    :History:
+        | 2018-Apr-13 - Written - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
 
-    def __init__(self, n, **kwargs):
+    def __init__(self, n, deterministic_prefix=True, **kwargs):
         self.n = n
+        self.deterministic_prefix = deterministic_prefix
+
+    @staticmethod
+    def _is_stochastic(layer):
+        if isinstance(layer, (MCDropout, MCGaussianDropout, MCConcreteDropout, MCBatchNorm, ErrorProp)):
+            return True
+        # a nested model is stochastic if any of its layers is
+        return isinstance(layer, tfk.Model) and any(FastMCInference._is_stochastic(l) for l in layer.layers)
+
+    @staticmethod
+    def _node_index(model, layer):
+        # index of the node of layer belonging to model, a layer can be shared by several models
+        network_nodes = getattr(model, '_network_nodes', None)
+        for node_index in range(len(layer._inbound_nodes)):
+            if network_nodes is None or f'{layer.name}_ib-{node_index}' in network_nodes:
+                return node_index
+        return 0
+
+    def split(self, model):
+        """
+        Split a model into a deterministic prefix model and a stochastic suffix model
+
+        :param model: Keras model
+        :type model: Union[keras.Model, keras.Sequential]
+        :return: prefix model and suffix model, or None if there is no deterministic layer to run only once
+        :rtype: Union[NoneType, tuple]
+        """
+        if len(model.inputs) != 1:
+            return None
+        # layers are in topological order, a layer is in the suffix if it is stochastic or depends on one
+        suffix_layers, suffix_tensors, frontier = [], set(), []
+        for layer in model.layers:
+            if isinstance(layer, tfk.layers.InputLayer):
+                continue
+            node_index = self._node_index(model, layer)
+            inputs = tf.nest.flatten(layer.get_input_at(node_index))
+            if self._is_stochastic(layer) or any(id(x) in suffix_tensors for x in inputs):
+                suffix_layers.append((layer, node_index))
+                for x in inputs:
+                    # deterministic tensors used by the suffix
+                    if id(x) not in suffix_tensors and all(x is not y for y in frontier):
+                        frontier.append(x)
+                suffix_tensors.update(id(x) for x in tf.nest.flatten(layer.get_output_at(node_index)))
+        if len(suffix_layers) == 0 or any(id(x) not in suffix_tensors for x in model.outputs):
+            return None
+        if len(frontier) == 1 and frontier[0] is model.inputs[0]:
+            # first stochastic layer takes the input directly, nothing to run only once
+            return None
+
+        # rebuild the suffix with the same (weight shared) layers on new inputs at the frontier
+        suffix_inputs = [tfk.layers.Input(shape=x.shape.as_list()[1:]) for x in frontier]
+        tensor_map = {id(x): new_x for x, new_x in zip(frontier, suffix_inputs)}
+        for layer, node_index in suffix_layers:
+            inputs = layer.get_input_at(node_index)
+            outputs = layer(tf.nest.map_structure(lambda x: tensor_map[id(x)], inputs))
+            for x, new_x in zip(tf.nest.flatten(layer.get_output_at(node_index)), tf.nest.flatten(outputs)):
+                tensor_map[id(x)] = new_x
+
+        prefix_model = tfk.models.Model(inputs=model.inputs, outputs=frontier)
+        suffix_model = tfk.models.Model(inputs=suffix_inputs, outputs=[tensor_map[id(x)] for x in model.outputs])
+        return prefix_model, suffix_model
 
     def __call__(self, model):
         """
@@ -463,9 +534,18 @@ class FastMCInference():
         else:
             raise TypeError(f'FastMCInference expects tensorflow.keras Model, you gave {type(model)}')
         new_input = tfk.layers.Input(shape=(self.model.input_shape[1:]), name='input')
-        mc_model = tfk.models.Model(inputs=self.model.inputs, outputs=self.model.outputs)
+        split = self.split(self.model) if self.deterministic_prefix else None
 
-        mc = FastMCInferenceMeanVar()(tfk.layers.TimeDistributed(mc_model)(FastMCRepeat(self.n)(new_input)))
+        if split is None:
+            mc_model = tfk.models.Model(inputs=self.model.inputs, outputs=self.model.outputs)
+            mc = FastMCInferenceMeanVar()(tfk.layers.TimeDistributed(mc_model)(FastMCRepeat(self.n)(new_input)))
+        else:
+            prefix_model, suffix_model = split
+            # run prefix once, then repeat its outputs n times as a batch of batch_size * n through the suffix
+            prefix_outputs = tf.nest.flatten(prefix_model(new_input))
+            suffix_inputs = [FastMCMergeAxis()(FastMCRepeat(self.n)(x)) for x in prefix_outputs]
+            suffix_outputs = suffix_model(suffix_inputs if len(suffix_inputs) > 1 else suffix_inputs[0])
+            mc = FastMCInferenceMeanVar()(FastMCSplitAxis(self.n)(suffix_outputs))
         new_mc_model = tfk.models.Model(inputs=new_input, outputs=mc)
 
         return new_mc_model
@@ -475,7 +555,7 @@ class FastMCInference():
         :return: Dictionary of configuration
         :rtype: dict
         """
-        config = {'n': self.n}
+        config = {'n': self.n, 'deterministic_prefix': self.deterministic_prefix}
         return config
 
 
@@ -566,6 +646,94 @@ class FastMCRepeat(Layer):
         return {**base_config.items(), **config}
 
 
+class FastMCMergeAxis(Layer):
+    """
+    Merge the Monte Carlo axis=1 of FastMCRepeat into the batch axis, (batch, n, ...) to (batch * n, ...)
+
+    :return: A layer
+    :rtype: object
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, name=None, **kwargs):
+        if not name:
+            prefix = self.__class__.__name__
+            name = prefix + '_' + str(tfk.backend.get_uid(prefix))
+        super().__init__(name=name, **kwargs)
+
+    def compute_output_shape(self, input_shape):
+        input_shape = tensor_shape.TensorShape(input_shape).as_list()
+        batch = None if None in input_shape[:2] else input_shape[0] * input_shape[1]
+        return tensor_shape.TensorShape([batch] + input_shape[2:])
+
+    def call(self, inputs, training=None):
+        """
+        :Note: Equivalent to __call__()
+        :param inputs: Tensor to be applied
+        :type inputs: tf.Tensor
+        :return: Tensor after applying the layer which is the reshaped Tensor
+        :rtype: tf.Tensor
+        """
+        # keep static shape of the other axes so layers like Dense still know their input shape
+        shape = [dim if dim is not None else tf.shape(inputs)[i + 2]
+                 for i, dim in enumerate(inputs.shape.as_list()[2:])]
+        return tf.reshape(inputs, [-1] + shape)
+
+    def get_config(self):
+        """
+        :return: Dictionary of configuration
+        :rtype: dict
+        """
+        config = {'None': None}
+        base_config = super().get_config()
+        return {**dict(base_config.items()), **config}
+
+
+class FastMCSplitAxis(Layer):
+    """
+    Split the batch axis of (batch * n, ...) back into batch and Monte Carlo axis=1, (batch, n, ...)
+
+    :param n: Number of Monte Carlo integration
+    :type n: int
+    :return: A layer
+    :rtype: object
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, n, name=None, **kwargs):
+        self.n = n
+        if not name:
+            prefix = self.__class__.__name__
+            name = prefix + '_' + str(tfk.backend.get_uid(prefix))
+        super().__init__(name=name, **kwargs)
+
+    def compute_output_shape(self, input_shape):
+        input_shape = tensor_shape.TensorShape(input_shape).as_list()
+        batch = None if input_shape[0] is None else input_shape[0] // self.n
+        return tensor_shape.TensorShape([batch, self.n] + input_shape[1:])
+
+    def call(self, inputs, training=None):
+        """
+        :Note: Equivalent to __call__()
+        :param inputs: Tensor to be applied
+        :type inputs: tf.Tensor
+        :return: Tensor after applying the layer which is the reshaped Tensor
+        :rtype: tf.Tensor
+        """
+        shape = [dim if dim is not None else tf.shape(inputs)[i + 1]
+                 for i, dim in enumerate(inputs.shape.as_list()[1:])]
+        return tf.reshape(inputs, [-1, self.n] + shape)
+
+    def get_config(self):
+        """
+        :return: Dictionary of configuration
+        :rtype: dict
+        """
+        config = {'n': self.n}
+        base_config = super().get_config()
+        return {**dict(base_config.items()), **config}
+
+
 class StopGrad(Layer):
     """
     Stop gradient backpropagation via this layer during training, act as an identity layer during testing by default.
@@ -664,6 +832,72 @@ class BoolMask(Layer):
         return {**dict(base_config.items()), **config}
 
 
+class Normalize(Layer):
+    """
+    Non-trainable layer to normalize (x - mean) / std, or denormalize x * std + mean if inverse is True, inside a neural
+    network, entries equal to MAGIC_NUMBER are passed through unchanged
+
+    :param mean: mean, scalar or broadcastable to a single example (e.g. featurewise mean of spectra)
+    :type mean: Union[float, list, ndarray]
+    :param std: standard derivation, scalar or broadcastable to a single example
+    :type std: Union[float, list, ndarray]
+    :param inverse: True to denormalize
+    :type inverse: bool
+    :return: A layer
+    :rtype: object
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, mean=0., std=1., inverse=False, name=None, **kwargs):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.inverse = inverse
+        if not name:
+            prefix = self.__class__.__name__
+            name = prefix + '_' + str(tfk.backend.get_uid(prefix))
+        kwargs['trainable'] = False
+        super().__init__(name=name, **kwargs)
+
+    def build(self, input_shape):
+        example_shape = tensor_shape.TensorShape(input_shape)[1:].as_list()
+        mean, std = self.mean.astype(np.float32), self.std.astype(np.float32)
+        # featurewise mean and std of (features, ) for inputs of (features, 1)
+        if None not in example_shape and mean.size == np.prod(example_shape):
+            mean = mean.reshape(example_shape)
+        if None not in example_shape and std.size == np.prod(example_shape):
+            std = std.reshape(example_shape)
+        self._mean_tensor = tf.constant(mean)
+        self._std_tensor = tf.constant(std)
+        super().build(input_shape)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def call(self, inputs, training=None):
+        """
+        :Note: Equivalent to __call__()
+        :param inputs: Tensor to be applied
+        :type inputs: tf.Tensor
+        :return: Tensor after applying the layer which is the normalized (or denormalized) tensor
+        :rtype: tf.Tensor
+        """
+        inputs = tf.cast(inputs, tf.float32)
+        if self.inverse:
+            outputs = inputs * self._std_tensor + self._mean_tensor
+        else:
+            outputs = (inputs - self._mean_tensor) / self._std_tensor
+        return tf.where(tf.equal(inputs, MAGIC_NUMBER), inputs, outputs)
+
+    def get_config(self):
+        """
+        :return: Dictionary of configuration
+        :rtype: dict
+        """
+        config = {'mean': self.mean.tolist(), 'std': self.std.tolist(), 'inverse': self.inverse}
+        base_config = super().get_config()
+        return {**dict(base_config.items()), **config}
+
+
 class PolyFit(Layer):
     """
     n-deg polynomial fitting layer which acts as an neural network layer to be optimized
@@ -0,0 +1,84 @@
+###############################################################################
+#   augmentation.py: augmentation of batches in data generators
+###############################################################################
+import numpy as np
+
+from astroNN.config import MAGIC_NUMBER
+
+
+class Augmenter(object):
+    """
+    | Top-level class for an augmenter, which augments a whole batch of inputs at once while the batch is prepared by
+    | the data generator, so augmented copies of the training set are never stored in memory.
+    | Sub-class needs to implement ``augment(x, rng, x_err)``, ``x`` is a newly prepared batch which can be modified in
+    | place, ``x_err`` is the batch of input uncertainty or None if the neural network has no input uncertainty.
+
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __call__(self, x, rng, x_err=None):
+        return self.augment(x, rng, x_err)
+
+    def augment(self, x, rng, x_err=None):
+        raise NotImplementedError
+
+
+class SpectraNoise(Augmenter):
+    """
+    Add gaussian noise with standard derivation of scale times the input uncertainty (or scale if there is no input
+    uncertainty) to spectra, pixels with MAGIC_NUMBER are not changed
+
+    :param scale: scale of noise
+    :type scale: float
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    def augment(self, x, rng, x_err=None):
+        noise = rng.standard_normal(x.shape, dtype=np.float32) if x.dtype == np.float32 else rng.standard_normal(x.shape)
+        noise *= self.scale
+        if x_err is not None:
+            noise *= x_err
+        noise[x == MAGIC_NUMBER] = 0.
+        x += noise
+        return x
+
+
+class SpectraMask(Augmenter):
+    """
+    Set a random fraction of pixels of spectra to MAGIC_NUMBER so they are ignored like bad pixels
+
+    :param fraction: fraction of pixels to mask
+    :type fraction: float
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, fraction=0.01):
+        self.fraction = fraction
+
+    def augment(self, x, rng, x_err=None):
+        x[rng.random(x.shape, dtype=np.float32) < self.fraction] = MAGIC_NUMBER
+        return x
+
+
+class ImageFlipRotate(Augmenter):
+    """
+    Randomly flip and rotate images by multiple of 90 degrees (only flip if images are not square), images are
+    in shape of (batch, height, width, channel)
+
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def augment(self, x, rng, x_err=None):
+        num_rotations = 4 if x.shape[1] == x.shape[2] else 1
+        # one of the 8 (or 2) symmetries for every image, every symmetry is applied to all its images at once
+        symmetry = rng.integers(2 * num_rotations, size=x.shape[0])
+        augmented = np.empty_like(x)
+        for i in range(2 * num_rotations):
+            images = x[symmetry == i]
+            if i >= num_rotations:
+                images = images[:, :, ::-1]
+            augmented[symmetry == i] = np.rot90(images, k=i % num_rotations, axes=(1, 2))
+        return augmented
@@ -1,6 +1,20 @@
+import os
+import queue
+import tempfile
+import threading
+import uuid
+
 import numpy as np
 
+import tensorflow as tf
 import tensorflow.keras as tfk
+from astroNN.config import MULTIPROCESS_FLAG
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8, memory-mapped file is used instead
+    shared_memory = None
+
 Sequence = tfk.utils.Sequence
 
 
@@ -9,23 +23,78 @@ class GeneratorMaster(Sequence):
     | Top-level class of astroNN data pipeline to generate data for NNs.
     | It is implemented based on Tensorflow data ``Sequence`` class.
 
-    You need to implement the ``__getitem__`` in the generator sub-class
+    You need to implement the ``_batch`` in the generator sub-class. A batch only depends on the permutation of the
+    current epoch and its index, so batches can be prepared by many workers in any order.
+
+    Only the rows of data in ``indices`` are used, so training and validation generators can share the same arrays
+    instead of each having a copy of their rows.
+
+    With ``sampler='block'``, contiguous blocks of ``block_size`` rows are visited in random order and rows are only
+    shuffled within a buffer of ``buffer_blocks`` blocks, so a batch reads a few contiguous regions of a file (e.g.
+    data from ``H5Loader`` with ``lazy=True``) instead of rows scattered over the whole file.
+
+    Inputs of batches are augmented by ``augment`` (an augmenter in ``astroNN.nn.utilities.augmentation`` or a list of
+    them) while batches are prepared, the randomness of augmentation is also a pure function of the epoch and rows.
 
-    :History: 2019-Feb-17 - Updated - Henry Leung (University of Toronto)
+    :History:
+        | 2019-Feb-17 - Updated - Henry Leung (University of Toronto)
+        | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
     """
 
-    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset):
+    def __init__(self, batch_size, shuffle, steps_per_epoch, data, manual_reset, indices=None, sampler='random',
+                 block_size=256, buffer_blocks=8):
         self.batch_size = batch_size
+        if MULTIPROCESS_FLAG is True:
+            # worker processes attach to the arrays by name instead of getting a copy of them
+            data = [array if isinstance(array, SharedArray) or not isinstance(array, np.ndarray) else
+                    SharedArray(array) for array in data]
         self.data = data
+        # rows of data used by this generator, None for all rows
+        self.indices = np.arange(data[0].shape[0]) if indices is None else np.asarray(indices)
         self.shuffle = shuffle
-        # see if it needs to be reset idx manually if on_epoch_end() cannot be reached like val_generator
+        if sampler not in ['random', 'block']:
+            raise ValueError(f"Unknown sampler '{sampler}', only 'random' or 'block' is accepted")
+        self.sampler = sampler  # 'random' to shuffle all rows or 'block' to shuffle blocks of contiguous rows
+        self.block_size = block_size  # number of contiguous rows in a block for 'block' sampler
+        self.buffer_blocks = buffer_blocks  # number of blocks rows are shuffled within for 'block' sampler
+        # no effect, batches are selected by index so there is nothing to reset even if on_epoch_end() is not called
         self.manual_reset = manual_reset
 
         self.steps_per_epoch = steps_per_epoch
+        # permutation of every epoch is seeded by seed + epoch, so every worker process has the same permutation
+        self.seed = np.random.randint(2 ** 31)
+        self.epoch = 0
+        self.idx_list = self._get_exploration_order(self.indices)
+        # number of reused batch buffers for every input, must be more than the number of batches in flight (being
+        # prepared by workers, waiting in the queue of keras and being used by tensorflow), None for default
+        self.num_buffers = None
+        self._buffers = {}
+        self._buffers_lock = threading.Lock()
+        # augmenter or list of augmenters for inputs, None for no augmentation
+        self.augment = None
+
+    def __getstate__(self):
+        # buffers are not needed by other processes and lock cannot be pickled
+        state = self.__dict__.copy()
+        state['_buffers'] = {}
+        state['_buffers_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffers_lock = threading.Lock()
 
     def __len__(self):
         return self.steps_per_epoch
 
+    def __getitem__(self, index):
+        return self._batch(self.idx_list[index * self.batch_size:(index + 1) * self.batch_size])
+
+    def on_epoch_end(self):
+        # new permutation for the next epoch, assigned at once so workers never see a partially shuffled list
+        self.epoch += 1
+        self.idx_list = self._get_exploration_order(self.indices)
+
     def _get_exploration_order(self, idx_list):
         """
         :param idx_list:
@@ -33,11 +102,75 @@ class GeneratorMaster(Sequence):
         """
         # shuffle (if applicable) and find exploration order
         if self.shuffle is True:
-            idx_list = np.copy(idx_list)
-            np.random.shuffle(idx_list)
+            rng = np.random.RandomState((self.seed + self.epoch) % 2 ** 32)
+            if self.sampler == 'block':
+                idx_list = _block_shuffle(np.sort(idx_list), rng, self.block_size, self.buffer_blocks)
+            else:
+                idx_list = rng.permutation(idx_list)
 
         return idx_list
 
+    def _batch(self, idx_list_temp):
+        """
+        Batch of the rows of data, in the structure given to the neural network
+
+        :param idx_list_temp: indices of rows in the batch
+        :type idx_list_temp: ndarray
+        :return: batch
+        :rtype: Union[ndarray, tuple, dict]
+        """
+        raise NotImplementedError
+
+    def to_dataset(self, cache=False):
+        """
+        | ``tf.data.Dataset`` giving the same batches as this generator, batches are prepared in parallel by
+        | tensorflow and prefetched while the neural network is training.
+        | If cache is used, batches are only prepared in the first epoch, only their order is shuffled afterward.
+
+        :param cache: False to not cache, True to cache batches in memory or filename to cache batches to a file
+        :type cache: Union[bool, str]
+        :return: dataset of batches for one epoch
+        :rtype: tf.data.Dataset
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        num_rows = self.indices.shape[0]
+        # structure and dtype of a batch, tensorflow needs them to build the dataset
+        example = self._batch(self.indices[:min(self.batch_size, num_rows)])
+        flat_example = tf.nest.flatten(example)
+
+        def read_batch(positions):
+            return [np.asarray(array) for array in tf.nest.flatten(self._batch(self.indices[positions]))]
+
+        def map_batch(idx_list_temp):
+            flat_batch = tf.numpy_function(read_batch, [idx_list_temp],
+                                           [tf.as_dtype(array.dtype) for array in flat_example])
+            for tensor, array in zip(flat_batch, flat_example):
+                tensor.set_shape((None, *array.shape[1:]))
+            return tf.nest.pack_sequence_as(example, flat_batch)
+
+        if self.shuffle is True and cache is False and self.sampler == 'block':
+            rng = np.random.RandomState(self.seed)
+            # positions of rows in sorted order, so blocks of positions are blocks of contiguous rows
+            sorted_positions = np.argsort(self.indices)
+
+            def epoch_order():
+                return _block_shuffle(sorted_positions, rng, self.block_size, self.buffer_blocks)
+
+            # the order is made again every time the dataset is iterated, i.e. every epoch
+            dataset = tf.data.Dataset.from_tensors(0).map(
+                lambda _: tf.ensure_shape(tf.numpy_function(epoch_order, [], tf.int64), [num_rows])).unbatch()
+        else:
+            dataset = tf.data.Dataset.range(num_rows)
+            if self.shuffle is True and cache is False:
+                dataset = dataset.shuffle(num_rows, reshuffle_each_iteration=True)
+        dataset = dataset.batch(self.batch_size, drop_remainder=True).take(self.steps_per_epoch)
+        dataset = dataset.map(map_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        if cache is not False:
+            dataset = dataset.cache('' if cache is True else cache)
+            if self.shuffle is True:
+                dataset = dataset.shuffle(self.steps_per_epoch, reshuffle_each_iteration=True)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
     def sparsify(self, y):
         """Returns labels in binary NumPy array"""
         # n_classes =  # Enter number of classes
@@ -45,22 +178,291 @@ class GeneratorMaster(Sequence):
         #                  for i in range(y.shape[0])])
         pass
 
+    def _batch_buffer(self, inputs, batch_size):
+        """
+        Next buffer from the ring of preallocated buffers of inputs, buffers are reused instead of allocating a new
+        array for every batch
+
+        :param inputs: data
+        :type inputs: ndarray
+        :param batch_size: number of rows in the batch
+        :type batch_size: int
+        :return: buffer with the dtype of inputs
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        shape = (batch_size, *inputs.shape[1:])
+        with self._buffers_lock:
+            ring = self._buffers.get(id(inputs))
+            if ring is None or ring[0][0].shape != shape:
+                # workers of keras + max_queue_size of keras + batches being used by tensorflow
+                num_buffers = os.cpu_count() + 16 if self.num_buffers is None else self.num_buffers
+                ring = [[np.empty(shape, dtype=inputs.dtype) for _ in range(num_buffers)], 0]
+                self._buffers[id(inputs)] = ring
+            buffers, position = ring
+            ring[1] = (position + 1) % len(buffers)
+        return buffers[position]
+
     def input_d_checking(self, inputs, idx_list_temp):
-        if inputs.ndim == 2:
-            x = np.empty((len(idx_list_temp), inputs.shape[1], 1))
-            # Generate data
-            x[:, :, 0] = inputs[idx_list_temp]
-
-        elif inputs.ndim == 3:
-            x = np.empty((len(idx_list_temp), inputs.shape[1], inputs.shape[2], 1))
-            # Generate data
-            x[:, :, :, 0] = inputs[idx_list_temp]
-
-        elif inputs.ndim == 4:
-            x = np.empty((len(idx_list_temp), inputs.shape[1], inputs.shape[2], inputs.shape[3]))
-            # Generate data
-            x[:, :, :, :] = inputs[idx_list_temp]
-        else:
+        if inputs.ndim not in [2, 3, 4]:
             raise ValueError(f"Unsupported data dimension, your data has {inputs.ndim} dimension")
 
+        if isinstance(inputs, SharedArray):
+            inputs = inputs.array
+        if isinstance(inputs, np.ndarray):
+            x = self._batch_buffer(inputs, len(idx_list_temp))
+            # Generate data, rows are gathered straight into the buffer, 'clip' mode avoids numpy buffering out
+            np.take(inputs, idx_list_temp, axis=0, out=x, mode='clip')
+        else:
+            # lazy data (e.g. LazyArray) gives a new array when indexed anyway
+            x = np.asarray(inputs[idx_list_temp])
+
+        # channel axis is added as a view without copying
+        return x if inputs.ndim == 4 else x[..., np.newaxis]
+
+
+    def augment_inputs(self, x, idx_list_temp, x_err=None):
+        """
+        Augment a batch of inputs with augmenters in ``augment``
+
+        :param x: batch of inputs
+        :type x: ndarray
+        :param idx_list_temp: indices of rows in the batch
+        :type idx_list_temp: ndarray
+        :param x_err: batch of inputs uncertainty, None if there is no inputs uncertainty
+        :type x_err: Union[NoneType, ndarray]
+        :return: augmented inputs
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if self.augment is None:
+            return x
+        # seeded by epoch and rows so workers and tf.data give the same augmentation for the same batch
+        rng = np.random.default_rng([self.seed, self.epoch, *np.asarray(idx_list_temp, dtype=np.uint64)])
+        for augmenter in (self.augment if isinstance(self.augment, (list, tuple)) else [self.augment]):
+            x = augmenter(x, rng, x_err)
         return x
+
+
+def _block_shuffle(idx_list, rng, block_size, buffer_blocks):
+    """
+    Shuffle the order of blocks of contiguous entries, then shuffle entries within buffers of a few blocks
+
+    :param idx_list: indices, sorted to have blocks of contiguous rows
+    :type idx_list: ndarray
+    :param rng: random state
+    :type rng: numpy.random.RandomState
+    :param block_size: number of entries in a block
+    :type block_size: int
+    :param buffer_blocks: number of consecutive blocks (after shuffling blocks) to shuffle entries within
+    :type buffer_blocks: int
+    :return: shuffled indices
+    :rtype: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    num_entries = idx_list.shape[0]
+    block_id = np.arange(num_entries) // block_size
+    block_rank = np.empty(block_id[-1] + 1 if num_entries > 0 else 0, dtype=np.int64)
+    block_rank[rng.permutation(block_rank.shape[0])] = np.arange(block_rank.shape[0])
+    # entries sorted by buffer of their block, random order within a buffer
+    order = np.lexsort((rng.random_sample(num_entries), block_rank[block_id] // buffer_blocks))
+    return idx_list[order]
+
+
+class PrefetchGenerator(GeneratorMaster):
+    """
+    | Wrap a generator to prepare its batches ahead of time in a background thread, so reading data from disk
+    | (e.g. from h5 file with ``H5Loader``) overlaps with the neural network computation.
+    | The wrapped generator is reset by the background thread after every epoch. Batches requested out of order are
+    | read directly from the wrapped generator.
+
+    :param generator: generator to be wrapped
+    :type generator: GeneratorMaster
+    :param prefetch: number of batches to prepare ahead of time
+    :type prefetch: int
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, generator, prefetch=4):
+        super().__init__(batch_size=generator.batch_size, shuffle=generator.shuffle,
+                         steps_per_epoch=generator.steps_per_epoch, data=generator.data,
+                         manual_reset=generator.manual_reset, indices=generator.indices,
+                         sampler=generator.sampler, block_size=generator.block_size,
+                         buffer_blocks=generator.buffer_blocks)
+        self.generator = generator
+        self.prefetch = prefetch
+        # batches in the queue, one being prepared and the ones being used by tensorflow
+        self.generator.num_buffers = prefetch + 4
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._next = None
+
+    def _put(self, item):
+        # put into queue but give up if the generator is closed
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prefetch_batches(self):
+        try:
+            while not self._stop.is_set():
+                for index in range(len(self.generator)):
+                    if not self._put((index, self.generator[index])):
+                        return
+                self.generator.on_epoch_end()
+        except Exception as e:
+            # error will be raised in the main thread
+            self._put(e)
+
+    def __getitem__(self, index):
+        if self._thread is None:
+            self._queue = queue.Queue(maxsize=self.prefetch)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._prefetch_batches, daemon=True)
+            self._thread.start()
+        while True:
+            if self._next is None:
+                self._next = self._queue.get()
+                if isinstance(self._next, Exception):
+                    raise self._next
+            queued_index, batch = self._next
+            if queued_index == index:
+                self._next = None
+                return batch
+            elif queued_index > index:
+                # e.g. keras reads the first batch to check the data, batches only depend on index so read directly
+                return self.generator[index]
+            # batch skipped by keras
+            self._next = None
+
+    def on_epoch_end(self):
+        # the wrapped generator is reset by the background thread after every epoch
+        pass
+
+    def close(self):
+        """
+        Stop the background thread
+
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+            self._next = None
+
+
+class LazyArray(object):
+    """
+    | Array-like view of rows of another array-like (e.g. ``H5LazyArray`` from ``H5Loader``) with an optional function
+    | applied to the rows only when they are indexed, used to normalize data batch by batch without having the whole
+    | dataset in memory.
+
+    :param data: array-like which can be indexed with array of indices along the first axis
+    :type data: Union[ndarray, astroNN.datasets.h5.H5LazyArray, LazyArray]
+    :param func: function applied to rows when they are indexed, must be picklable for multiprocessing
+    :type func: Union[callable, NoneType]
+    :param indices: indices of rows of data in the view, None for all rows
+    :type indices: Union[ndarray, NoneType]
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, data, func=None, indices=None):
+        self.data = data
+        self.func = func
+        self.indices = indices
+        self.shape = (data.shape[0] if indices is None else len(indices), *data.shape[1:])
+        self.ndim = len(self.shape)
+        self.dtype = data.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows = self.data[key if self.indices is None else self.indices[key]]
+        return rows if self.func is None else self.func(rows)
+
+    def subset(self, indices):
+        """
+        View of some rows without reading them
+
+        :param indices: indices of rows
+        :type indices: ndarray
+        :return: view of the rows
+        :rtype: LazyArray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        indices = np.asarray(indices)
+        return LazyArray(self.data, func=self.func, indices=indices if self.indices is None else self.indices[indices])
+
+
+class SharedArray(object):
+    """
+    | Copy of a numpy array in shared memory (or a memory-mapped temporary file if shared memory is not available),
+    | when pickled to other processes only the name of the shared memory is pickled and the other processes attach
+    | to it, so starting worker processes does not depend on the size of the array.
+    | The shared memory is released when the SharedArray in the process created it is deleted.
+
+    :param array: array to be copied to shared memory
+    :type array: ndarray
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, array):
+        array = np.asarray(array)
+        self.shape = array.shape
+        self.ndim = array.ndim
+        self.dtype = array.dtype
+        self._owner = True
+        if shared_memory is not None:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.name = self._shm.name
+            self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        else:
+            self._shm = None
+            self.name = os.path.join(tempfile.gettempdir(), f'astroNN_{uuid.uuid4().hex}.dat')
+            self.array = np.memmap(self.name, dtype=self.dtype, mode='w+', shape=self.shape)
+        self.array[...] = array
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __getstate__(self):
+        # only the name is pickled, not the data
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.ndim = len(self.shape)
+        self._owner = False
+        if shared_memory is not None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+            self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        else:
+            self._shm = None
+            self.array = np.memmap(self.name, dtype=self.dtype, mode='r', shape=self.shape)
+
+    def __del__(self):
+        if getattr(self, '_owner', False) is True:
+            # other processes can still use it until they detach, memory is freed after every process detached
+            if self._shm is not None:
+                self._shm.unlink()
+            else:
+                self.array = None
+                try:
+                    os.remove(self.name)
+                except OSError:  # still opened by other processes on Windows
+                    pass
+
@@ -35,12 +35,19 @@ class Normalizer(object):
         self._custom_norm_func = None
         self._custom_denorm_func = None
 
-    def mode_checker(self, data):
+        # number of non-magic entries, mean and sum of squared deviations of every feature accumulated by partial_fit()
+        self._fit_count = None
+        self._fit_mean = None
+        self._fit_m2 = None
+
+    def mode_checker(self, data, copy=True):
 
         if data.ndim == 1:
             data_array = np.expand_dims(data, 1)
-        else:
+        elif copy is True:
             data_array = np.array(data)
+        else:
+            data_array = np.asarray(data)
 
         self.normalization_mode = str(self.normalization_mode)  # just to prevent unnecessary type issue
 
@@ -49,7 +56,7 @@ class Normalizer(object):
                 warnings.warn("Data type is detected as bool, setting normalization_mode to 0 which is doing nothing "
                               "because no normalization can be done on bool")
                 self.normalization_mode = '0'
-            data_array = data_array.astype(np.float)
+            data_array = data_array.astype(np.float64)
 
         if self.normalization_mode == '0':
             self.featurewise_center = False
@@ -98,59 +105,176 @@ class Normalizer(object):
 
         return data_array
 
-    def normalize(self, data, calc=True):
-        data_array = self.mode_checker(data)
+    def reset_fit(self):
+        """
+        Forget the moments accumulated by ``partial_fit()``
 
-        magic_mask = [(data_array == MAGIC_NUMBER)]
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        self._fit_count = None
+        self._fit_mean = None
+        self._fit_m2 = None
 
-        if calc is True:  # check if normalizing with predefine values or get a new one
-            print(f'====Message from {self.__class__.__name__}====')
-            print(f'You selected mode: {self.normalization_mode}')
-            print(f'Featurewise Center: {self.featurewise_center}')
-            print(f'Datawise Center: {self.datasetwise_center}')
-            print(f'Featurewise std Center: {self.featurewise_stdalization}')
-            print(f'Datawise std Center: {self.datasetwise_stdalization}')
-            print('====Message ends====')
-
-            if self.featurewise_center is True:
-                self.mean_labels = np.ma.array(data_array, mask=magic_mask).mean(axis=0)
-                data_array -= self.mean_labels
-            elif self.datasetwise_center is True:
-                self.mean_labels = np.ma.array(data_array, mask=magic_mask).mean()
-                data_array -= self.mean_labels
-
-            if self.featurewise_stdalization is True:
-                self.std_labels = np.ma.array(data_array, mask=magic_mask).std(axis=0)
-                data_array /= self.std_labels
-            elif self.datasetwise_stdalization is True:
-                self.std_labels = np.ma.array(data_array, mask=magic_mask).std()
-                data_array /= self.std_labels
-
-            if self.normalization_mode == '255':
-                data_array -= self.mean_labels
-                data_array /= self.std_labels
+    def partial_fit(self, data):
+        """
+        Accumulate the mean and variance of a chunk of data (entries with MAGIC_NUMBER are ignored) and update
+        ``mean_labels`` and ``std_labels`` to the ones of all the chunks so far, so the normalizer can be fitted on
+        data which does not fit in memory
+
+        :param data: chunk of data, rows along the first axis
+        :type data: ndarray
+        :return: the normalizer itself
+        :rtype: Normalizer
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        data_array = self.mode_checker(np.asarray(data), copy=False)
+        not_magic = data_array != MAGIC_NUMBER
+        count = not_magic.sum(axis=0)
+        # moments of the chunk in float64, then merged with the previous chunks (Chan et al. 1979)
+        mean = np.where(not_magic, data_array, 0.).sum(axis=0, dtype=np.float64) / np.maximum(count, 1)
+        m2 = np.square(np.where(not_magic, data_array - mean, 0.)).sum(axis=0, dtype=np.float64)
+        if self._fit_count is None:
+            self._fit_count, self._fit_mean, self._fit_m2 = count, mean, m2
         else:
-            data_array -= self.mean_labels
-            data_array /= self.std_labels
+            total_count = self._fit_count + count
+            delta = mean - self._fit_mean
+            self._fit_mean = self._fit_mean + delta * count / np.maximum(total_count, 1)
+            self._fit_m2 = self._fit_m2 + m2 + delta ** 2 * self._fit_count * count / np.maximum(total_count, 1)
+            self._fit_count = total_count
 
-        if self._custom_norm_func is not None:
-            data_array = self._custom_norm_func(data_array)
+        if self.featurewise_center is True:
+            self.mean_labels = self._fit_mean
+        if self.featurewise_stdalization is True:
+            self.std_labels = np.sqrt(self._fit_m2 / np.maximum(self._fit_count, 1))
+        if self.datasetwise_center is True or self.datasetwise_stdalization is True:
+            # merge the moments of every feature
+            total_count = max(self._fit_count.sum(), 1)
+            datasetwise_mean = (self._fit_count * self._fit_mean).sum() / total_count
+            datasetwise_m2 = (self._fit_m2 + self._fit_count * (self._fit_mean - datasetwise_mean) ** 2).sum()
+            if self.datasetwise_center is True:
+                self.mean_labels = datasetwise_mean
+            if self.datasetwise_stdalization is True:
+                self.std_labels = np.sqrt(datasetwise_m2 / total_count)
+        return self
 
-        np.place(data_array, magic_mask, MAGIC_NUMBER)
+    def fit(self, data, chunk_size=None):
+        """
+        Calculate ``mean_labels`` and ``std_labels`` from data chunk by chunk, entries with MAGIC_NUMBER are ignored
 
-        return data_array
+        :param data: data which can be sliced along the first axis (e.g. ndarray or spectra from H5Loader with
+            lazy=True) or an iterable of chunks
+        :type data: Union[ndarray, astroNN.datasets.h5.H5LazyArray, iterable]
+        :param chunk_size: number of rows in a chunk, None for chunks of about 16 million entries
+        :type chunk_size: Union[NoneType, int]
+        :return: the normalizer itself
+        :rtype: Normalizer
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        self.mode_checker(np.zeros(1))
+        print(f'====Message from {self.__class__.__name__}====')
+        print(f'You selected mode: {self.normalization_mode}')
+        print(f'Featurewise Center: {self.featurewise_center}')
+        print(f'Datawise Center: {self.datasetwise_center}')
+        print(f'Featurewise std Center: {self.featurewise_stdalization}')
+        print(f'Datawise std Center: {self.datasetwise_stdalization}')
+        print('====Message ends====')
 
-    def denormalize(self, data):
-        data_array = self.mode_checker(data)
+        self.reset_fit()
+        chunks = data
+        if hasattr(data, 'shape'):
+            if chunk_size is None:
+                chunk_size = max(2 ** 24 // max(int(np.prod(data.shape[1:])), 1), 1)
+            chunks = (data[i:i + chunk_size] for i in range(0, data.shape[0], chunk_size))
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        return self
 
-        magic_mask = [data_array == MAGIC_NUMBER]
+    def _transform(self, data_array, out, dtype, inverse=False):
+        """
+        Normalize (or denormalize if inverse is True) data into out, chunk by chunk so the mask of MAGIC_NUMBER and
+        temporary arrays of a chunk stay in cache, entries with MAGIC_NUMBER are kept as MAGIC_NUMBER
 
-        if self._custom_denorm_func is not None:
-            data_array = self._custom_denorm_func(data_array)
+        :param data_array: data
+        :type data_array: ndarray
+        :param out: output array with the shape of data_array, can be data_array itself, None to create a new one
+        :type out: Union[NoneType, ndarray]
+        :param dtype: dtype of the output array if out is None, None to keep the dtype of floating point data
+        :type dtype: Union[NoneType, type]
+        :param inverse: True to denormalize
+        :type inverse: bool
+        :return: out
+        :rtype: ndarray
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if out is None:
+            if dtype is None:
+                dtype = data_array.dtype if np.issubdtype(data_array.dtype, np.floating) else np.float64
+            out = np.empty(data_array.shape, dtype=dtype)
+        elif out.ndim == 1:
+            out = np.expand_dims(out, 1)
+        # in the dtype of output so float32 data is not computed in float64
+        mean_labels = np.asarray(self.mean_labels, dtype=out.dtype)
+        std_labels = np.asarray(self.std_labels, dtype=out.dtype)
+        chunk_size = max(2 ** 16 // max(int(np.prod(data_array.shape[1:])), 1), 1)
+        for i in range(0, data_array.shape[0], chunk_size):
+            chunk, out_chunk = data_array[i:i + chunk_size], out[i:i + chunk_size]
+            # mask before writing to out in case out is data_array
+            magic_mask = chunk == MAGIC_NUMBER
+            if inverse is False:
+                np.subtract(chunk, mean_labels, out=out_chunk, casting='unsafe')
+                out_chunk /= std_labels
+                if self._custom_norm_func is not None:
+                    out_chunk[...] = self._custom_norm_func(out_chunk)
+            else:
+                if self._custom_denorm_func is not None:
+                    chunk = self._custom_denorm_func(chunk)
+                np.multiply(chunk, std_labels, out=out_chunk, casting='unsafe')
+                out_chunk += mean_labels
+            if magic_mask.any():
+                out_chunk[magic_mask] = MAGIC_NUMBER
+        return out
 
-        data_array *= self.std_labels
-        data_array += self.mean_labels
+    def normalize(self, data, calc=True, out=None, dtype=None):
+        """
+        Normalize data, entries with MAGIC_NUMBER are kept as MAGIC_NUMBER
 
-        np.place(data_array, magic_mask, MAGIC_NUMBER)
+        :param data: data
+        :type data: ndarray
+        :param calc: True to calculate mean and standard derivation from data, False to use the existing ones
+        :type calc: bool
+        :param out: output array with the shape of data, can be data itself to normalize in place, None for new array
+        :type out: Union[NoneType, ndarray]
+        :param dtype: dtype of the output array if out is None (e.g. np.float32), None to keep the dtype of data
+        :type dtype: Union[NoneType, type]
+        :return: normalized data
+        :rtype: ndarray
+        :History:
+            | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
+        """
+        data_array = self.mode_checker(data, copy=False)
 
-        return data_array
+        if calc is True:  # check if normalizing with predefine values or get a new one
+            self.fit(data_array)
+
+        return self._transform(data_array, out, dtype)
+
+    def denormalize(self, data, out=None, dtype=None):
+        """
+        Denormalize data, entries with MAGIC_NUMBER are kept as MAGIC_NUMBER
+
+        :param data: normalized data
+        :type data: ndarray
+        :param out: output array with the shape of data, can be data itself to denormalize in place, None for new array
+        :type out: Union[NoneType, ndarray]
+        :param dtype: dtype of the output array if out is None, None to keep the dtype of data
+        :type dtype: Union[NoneType, type]
+        :return: denormalized data
+        :rtype: ndarray
+        :History:
+            | 2018-Jan-06 - Written - Henry Leung (University of Toronto)
+            | 2026-Oct-16 - Updated - Henry Leung (University of Toronto)
+        """
+        data_array = self.mode_checker(data, copy=False)
+
+        return self._transform(data_array, out, dtype, inverse=True)
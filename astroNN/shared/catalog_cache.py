@@ -0,0 +1,115 @@
+# ---------------------------------------------------------#
+#   astroNN.shared.catalog_cache: columnar cache of catalogs
+# ---------------------------------------------------------#
+
+import hashlib
+import os
+import uuid
+
+import numpy as np
+from astropy.io import fits
+
+from astroNN.config import astroNN_CACHE_DIR
+from astroNN.shared.downloader_tools import filehash
+
+_CATALOG_CACHE_DIR = os.path.join(astroNN_CACHE_DIR, 'catalog_cache')
+
+
+class CatalogCache(object):
+    """
+    Columns of a FITS table cached as memory-mapped .npy files under astroNN cache folder, keyed by the hash of the
+    FITS file. A column is converted from the FITS table the first time it is used, after that reading it is a
+    memory-map of the .npy file which is shared by every process reading the same catalog.
+
+    :param filename: full path of the FITS file
+    :type filename: str
+    :param hdu: HDU of the table
+    :type hdu: int
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+
+    def __init__(self, filename, hdu=1):
+        self.filename = filename
+        self.hdu = hdu
+        self.cache_dir = os.path.join(_CATALOG_CACHE_DIR, _catalog_hash(filename), str(hdu))
+        self._columns = {}
+        self._names = None
+
+    @property
+    def names(self):
+        """
+        Names of the columns in the table
+        """
+        if self._names is None:
+            header = fits.getheader(self.filename, self.hdu)
+            self._names = [header[f'TTYPE{i + 1}'] for i in range(header['TFIELDS'])]
+        return self._names
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return self[self.names[0]].shape[0]
+
+    def __getitem__(self, name):
+        """
+        Read-only memory-map of a column, convert the column from the FITS file if it is not cached yet
+        """
+        if name not in self._columns:
+            path = os.path.join(self.cache_dir, f'{name}.npy')
+            if not os.path.isfile(path):
+                self.cache_columns([name])
+            self._columns[name] = np.load(path, mmap_mode='r')
+        return self._columns[name]
+
+    def cache_columns(self, names=None):
+        """
+        Convert columns from the FITS file to .npy in one read of the FITS file
+
+        :param names: names of columns to convert, None to convert all columns
+        :type names: list
+        :return: None
+        :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+        """
+        if names is None:
+            names = self.names
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        with fits.open(self.filename, memmap=True) as F:
+            for name in names:
+                column = np.asarray(F[self.hdu].data[name])
+                if column.dtype.kind in ['U', 'S']:
+                    # FITS strings are padded with spaces, astropy strips them on comparison but numpy does not
+                    column = np.char.rstrip(column)
+                else:
+                    column = column.astype(column.dtype.newbyteorder('='), copy=False)
+                # write to a temporary file first so other processes never see a partially written column
+                temp_path = os.path.join(self.cache_dir, f'{name}.{uuid.uuid4().hex}.tmp.npy')
+                np.save(temp_path, column)
+                os.replace(temp_path, os.path.join(self.cache_dir, f'{name}.npy'))
+
+
+def _catalog_hash(filename):
+    """
+    sha256 hash of a catalog, the hash is computed once and reused until the file size or modification time changes
+
+    :param filename: full path of the file
+    :type filename: str
+    :return: hash of the file
+    :rtype: str
+    :History: 2026-Oct-16 - Written - Henry Leung (University of Toronto)
+    """
+    stat = os.stat(filename)
+    stat_key = hashlib.sha256(f'{os.path.abspath(filename)}{stat.st_size}{stat.st_mtime_ns}'.encode()).hexdigest()
+    stat_path = os.path.join(_CATALOG_CACHE_DIR, 'hash', stat_key)
+    if os.path.isfile(stat_path):
+        with open(stat_path, 'r') as f:
+            return f.read()
+
+    file_hash = filehash(filename, algorithm='sha256')
+    os.makedirs(os.path.dirname(stat_path), exist_ok=True)
+    temp_path = f'{stat_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(file_hash)
+    os.replace(temp_path, stat_path)
+    return file_hash
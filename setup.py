@@ -31,7 +31,8 @@ setup(
         'packaging'],
     extras_require={
         "tensorflow": ["tensorflow>=2.0.0"],
-        "tensorflow-probability": ["tensorflow-probability>=0.8.0"]},
+        "tensorflow-probability": ["tensorflow-probability>=0.8.0"],
+        "hdf5plugin": ["hdf5plugin"]},
     url='https://github.com/henrysky/astroNN',
     project_urls={
         "Bug Tracker": "https://github.com/henrysky/astroNN/issues",
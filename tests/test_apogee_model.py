@@ -1,3 +1,4 @@
+import time
 import unittest
 
 import numpy as np
@@ -5,6 +6,23 @@ import numpy as np
 from astroNN.models import ApogeeCNN, ApogeeBCNN, ApogeeBCNNCensored, ApogeeDR14GaiaDR2BCNN, StarNet2017, ApogeeCVAE
 from astroNN.models import load_folder
 from astroNN.nn.callbacks import ErrorOnNaN
+from astroNN.nn.layers import FastMCInference
+
+
+def fast_mc_speedup(neuralnet, data, mc_num=10):
+    """
+    Print and return the speed-up of running the deterministic prefix of a BCNN only once in FastMCInference
+    """
+    times = []
+    for deterministic_prefix in [False, True]:
+        mc_model = FastMCInference(mc_num, deterministic_prefix=deterministic_prefix)(neuralnet.keras_model_predict)
+        mc_model.predict(data[:1])  # warm up
+        start_time = time.time()
+        mc_model.predict(data, batch_size=neuralnet.batch_size)
+        times.append(time.time() - start_time)
+    print(f'{neuralnet.name} FastMCInference with deterministic prefix: {times[1]:.{3}f}s, '
+          f'without: {times[0]:.{3}f}s, speed-up: {times[0] / times[1]:.{2}f}x')
+    return times[0] / times[1]
 
 
 class ApogeeModelTestCase(unittest.TestCase):
@@ -112,6 +130,7 @@ class ApogeeModelTestCase(unittest.TestCase):
         # prevent memory issue on Tavis CI so set mc_num=2
         bneuralnet.mc_num = 2
         prediction, prediction_err = bneuralnet.test(random_xdata)
+        fast_mc_speedup(bneuralnet, random_xdata)
         # assert all of them not equal becaues of MC Dropout
         self.assertEqual(
             np.all(bneuralnet.evaluate(random_xdata, random_ydata) != bneuralnet.evaluate(random_xdata, random_ydata)),
@@ -128,6 +147,23 @@ class ApogeeModelTestCase(unittest.TestCase):
         bneuralnet_loaded.mc_num = 2
         pred, pred_err = bneuralnet_loaded.test(random_xdata)
         bneuralnet_loaded.aspcap_residue_plot(pred, pred, pred_err['total'])
+
+        # chunked Monte Carlo, draws merged from blocks of 2
+        bneuralnet_loaded.mc_num = 5
+        bneuralnet_loaded.mc_chunk_size = 2
+        pred_chunked, pred_chunked_err = bneuralnet_loaded.test(random_xdata)
+        np.testing.assert_array_equal(pred_chunked.shape, random_ydata.shape)
+        self.assertEqual(np.all(np.isfinite(pred_chunked_err['model'])), True)
+
+        # adaptive Monte Carlo, stop drawing once the standard error is below tolerance
+        bneuralnet_loaded.mc_num = 6
+        bneuralnet_loaded.mc_tol = 1e-3
+        pred_adaptive, pred_adaptive_err = bneuralnet_loaded.test(random_xdata)
+        np.testing.assert_array_equal(pred_adaptive.shape, random_ydata.shape)
+        self.assertEqual(np.all((pred_adaptive_err['mc_num'] >= 2) & (pred_adaptive_err['mc_num'] <= 6)), True)
+        bneuralnet_loaded.mc_num = 2
+        bneuralnet_loaded.mc_chunk_size = None
+        bneuralnet_loaded.mc_tol = None
         bneuralnet_loaded.jacobian_aspcap(jacobian)
         bneuralnet_loaded.save()
 
@@ -157,6 +193,7 @@ class ApogeeModelTestCase(unittest.TestCase):
         # prevent memory issue on Tavis CI
         bneuralnetcensored.mc_num = 2
         prediction, prediction_err = bneuralnetcensored.test(random_xdata)
+        fast_mc_speedup(bneuralnetcensored, random_xdata)
         np.testing.assert_array_equal(prediction.shape, random_ydata.shape)
         bneuralnetcensored.save(name='apogee_bcnncensored')
         bneuralnetcensored_loaded = load_folder("apogee_bcnncensored")
@@ -193,6 +230,7 @@ class ApogeeModelTestCase(unittest.TestCase):
         # prevent memory issue on Tavis CI
         apogeedr14gaiadr2bcnn.mc_num = 2
         prediction, prediction_err = apogeedr14gaiadr2bcnn.test(random_xdata)
+        fast_mc_speedup(apogeedr14gaiadr2bcnn, random_xdata)
         np.testing.assert_array_equal(prediction.shape, random_ydata.shape)
         apogeedr14gaiadr2bcnn.save(name='apogeedr14_gaiadr2')
         bneuralnetcensored_loaded = load_folder("apogeedr14_gaiadr2")
@@ -2,6 +2,7 @@ import unittest
 
 import requests
 import numpy as np
+import numpy.testing as npt
 from astroNN.data import datapath, data_description
 from astroNN.datasets.galaxy10 import _G10_ORIGIN
 from astroNN.datasets.galaxy10 import galaxy10cls_lookup, galaxy10_confusion
@@ -44,6 +45,87 @@ class DatasetTestCase(unittest.TestCase):
         self.assertRaises(ValueError, galaxy10cls_lookup, 11)
         galaxy10_confusion(np.ones((10,10)))
 
+    def test_h5_compact(self):
+        import h5py
+        import tempfile
+        from astroNN.datasets.h5 import _compact_dataset
+
+        data = np.arange(20, dtype=np.float32)
+        keep = (data % 3) != 0
+        with tempfile.TemporaryFile() as f, h5py.File(f, 'w') as h5f:
+            h5f.create_dataset('data', data=data, maxshape=(None,), chunks=True)
+            _compact_dataset(h5f['data'], keep, batch_size=4)
+            np.testing.assert_array_equal(h5f['data'][:], data[keep])
+
+    def test_h5_lazy_rows(self):
+        import h5py
+        import os
+        import pickle
+        import tempfile
+        from astroNN.datasets.h5 import H5LazyArray, _read_rows
+
+        data = np.random.normal(size=(3000, 5)).astype(np.float16)
+        rows = np.sort(np.random.choice(3000, 400, replace=False))
+        with tempfile.TemporaryDirectory() as folder:
+            h5path = os.path.join(folder, 'lazy.h5')
+            with h5py.File(h5path, 'w') as h5f:
+                h5f.create_dataset('spectra', data=data)
+                # sorted, unsorted and repeated rows are read in the requested order and upcasted to float32
+                for idx in [rows, rows[::-1], np.array([5, 5, 2])]:
+                    npt.assert_array_equal(_read_rows(h5f['spectra'], idx, max_block=16), data[idx].astype(np.float32))
+
+            lazy_spectra = pickle.loads(pickle.dumps(H5LazyArray(h5path, 'spectra', rows)))
+            self.assertEqual(lazy_spectra.shape, (400, 5))
+            npt.assert_array_equal(lazy_spectra[[3, 1]], data[rows[[3, 1]]])
+            npt.assert_array_equal(lazy_spectra[10:20, 2], data[rows[10:20], 2])
+            npt.assert_array_equal(np.asarray(lazy_spectra), data[rows])
+            lazy_spectra._h5f.close()
+
+    def test_h5_virtual_index(self):
+        import h5py
+        import os
+        import tempfile
+        from astroNN.datasets import H5Loader, h5_virtual_index
+
+        spectra = np.random.normal(size=(30, 5)).astype(np.float32)
+        teff = np.random.normal(size=30).astype(np.float32)
+        in_flag = np.tile(np.array([0, 1, 1], dtype=np.float32), 10)
+        with tempfile.TemporaryDirectory() as folder:
+            shards = []
+            for counter, (start, end) in enumerate([(0, 12), (12, 12), (12, 30)]):
+                shards.append(os.path.join(folder, f'shard{counter}.h5'))
+                with h5py.File(shards[-1], 'w') as h5f:
+                    for name, data in [('spectra', spectra), ('spectra_err', spectra), ('teff', teff),
+                                       ('in_flag', in_flag)]:
+                        h5f.create_dataset(name, data=data[start:end], maxshape=(None, *data.shape[1:]))
+            h5_virtual_index(os.path.join(folder, 'index.h5'), shards)
+
+            loader = H5Loader(os.path.join(folder, 'index.h5'), target=['teff'])
+            x, y = loader.load()
+            npt.assert_array_equal(x, spectra[in_flag == 0])
+            npt.assert_array_equal(y, teff[in_flag == 0])
+
+            # missing shard is not silently read as fill values
+            os.remove(shards[1])
+            self.assertRaises(FileNotFoundError, H5Loader, os.path.join(folder, 'index.h5'))
+
+    def test_star_selection(self):
+        from astroNN.datasets import Cut, StarSelection
+
+        catalog = {'SNR': np.array([50., 250., 300., np.nan]),
+                   'PARAM': np.array([[4500., 2.], [6000., 4.], [4800., 2.5], [4200., 1.]]),
+                   'TELESCOPE': np.array(['apo25m', 'apo25m', 'lco25m', 'apo25m'])}
+        selection = StarSelection(catalog)
+        cuts = [Cut('SNR', '>', 200), Cut('PARAM', '<=', 5500, index=0)]
+        npt.assert_array_equal(selection.select(cuts), [2])
+        npt.assert_array_equal(selection.select([Cut('TELESCOPE', 'in', ['apo25m'])]), [0, 1, 3])
+        npt.assert_array_equal(selection.mask([Cut('PARAM', lambda x, y: x > y, 1.5, index=1)]),
+                               [True, True, True, False])
+        # cuts are memoised individually and the same list of cuts is selected once
+        self.assertEqual(len(selection._masks), 4)
+        self.assertIs(selection.select(cuts[::-1]), selection.select(cuts))
+        self.assertRaises(ValueError, Cut, 'SNR', '=>', 200)
+
     def test_data(self):
         import os
         os.path.isdir(datapath())
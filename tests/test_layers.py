@@ -246,6 +246,30 @@ class LayerCase(unittest.TestCase):
         # make sure a mask with all 0 raises error of invalid mask
         self.assertRaises(ValueError, BoolMask, np.zeros(7514))
 
+    def test_Normalize(self):
+        print('==========Normalize tests==========')
+        from astroNN.nn.layers import Normalize
+        from astroNN.config import MAGIC_NUMBER
+
+        # Data preparation
+        mean, std = np.random.normal(0, 1, 100), np.random.uniform(1, 2, 100)
+        random_xdata = np.random.normal(0, 1, (10, 100))
+        random_xdata[0, :5] = MAGIC_NUMBER
+
+        input = Input(shape=[100])
+        norm = Normalize(mean=mean, std=std, name='norm')(input)
+        output = Normalize(mean=mean, std=std, inverse=True)(norm)
+        model = Model(inputs=input, outputs=[norm, output])
+        self.assertEqual(len(model.trainable_weights), 0)
+
+        x_norm, x = model.predict(random_xdata)
+        expected = (random_xdata - mean) / std
+        expected[0, :5] = MAGIC_NUMBER
+        npt.assert_almost_equal(x_norm, expected, decimal=4)
+        # magic number passed through both ways
+        npt.assert_almost_equal(x, random_xdata, decimal=4)
+        self.assertEqual(model.get_layer('norm').get_config()['mean'], mean.tolist())
+
     def test_FastMCInference(self):
         print('==========FastMCInference tests==========')
         from astroNN.nn.layers import FastMCInference
@@ -287,6 +311,24 @@ class LayerCase(unittest.TestCase):
         # make sure accelerated model has no variance (uncertainty) on deterministic model prediction
         self.assertAlmostEqual(np.sum(sy[:, :, 1]), 0.)
 
+        # deterministic prefix is run once and only the stochastic suffix is repeated
+        from astroNN.nn.layers import MCDropout
+        input = Input(shape=[7514])
+        dense = Dense(100, name='prefix_dense')(input)
+        b_dropout = MCDropout(0.2)(dense)
+        output = Dense(25)(b_dropout)
+        mc_model = Model(inputs=input, outputs=output)
+        prefix_model, suffix_model = FastMCInference(10).split(mc_model)
+        self.assertEqual(prefix_model.output_shape, (None, 100))
+        self.assertEqual([layer.name for layer in prefix_model.layers][-1], 'prefix_dense')
+        self.assertEqual(FastMCInference(10).split(model), None)  # no stochastic layer
+        acc_mc_model = FastMCInference(10)(mc_model)
+        acc_mc_model_full = FastMCInference(10, deterministic_prefix=False)(mc_model)
+        y = acc_mc_model.predict(random_xdata)
+        y_full = acc_mc_model_full.predict(random_xdata)
+        npt.assert_array_equal(y.shape, y_full.shape)
+        self.assertEqual(np.all(y[:, :, 1] > 0.), True)
+
     def test_PolyFit(self):
         print('==========PolyFit tests==========')
         from astroNN.nn.layers import PolyFit
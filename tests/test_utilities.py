@@ -42,6 +42,25 @@ class UtilitiesTestCase(unittest.TestCase):
         self.assertEqual(data_denorm[magic_idx], MAGIC_NUMBER)
         npt.assert_array_almost_equal(data_denorm, data)
 
+        # moments accumulated chunk by chunk are the same as the ones of the whole data
+        chunk_normer = Normalizer(mode=1)
+        chunk_normer.fit(data, chunk_size=7)
+        npt.assert_array_almost_equal(chunk_normer.mean_labels, normer.mean_labels)
+        npt.assert_array_almost_equal(chunk_normer.std_labels, normer.std_labels)
+        chunk_normer = Normalizer(mode=2)
+        for chunk in np.array_split(data, 3):
+            chunk_normer.partial_fit(chunk)
+        npt.assert_array_almost_equal(chunk_normer.std_labels[5], np.std(np.delete(data[:, 5], 10)))
+
+        # normalize in place or into float32 gives the same result
+        inplace_data = data.copy()
+        self.assertIs(normer.normalize(inplace_data, calc=False, out=inplace_data), inplace_data)
+        npt.assert_array_almost_equal(inplace_data, norm_data)
+        float32_data = normer.normalize(data, calc=False, dtype=np.float32)
+        self.assertEqual(float32_data.dtype, np.float32)
+        self.assertEqual(float32_data[magic_idx], MAGIC_NUMBER)
+        npt.assert_array_almost_equal(float32_data, norm_data, decimal=5)
+
         errorous_norm = Normalizer(mode=-1234)
 
         self.assertRaises(ValueError, errorous_norm.normalize, data)
@@ -78,6 +97,109 @@ class UtilitiesTestCase(unittest.TestCase):
         config_path(flag=1)
         config_path(flag=2)
 
+    def test_catalog_cache(self):
+        import tempfile
+        import numpy as np
+        from astropy.io import fits
+        from astroNN.shared.catalog_cache import CatalogCache
+
+        apogee_id = np.array(['2M00000002+7417074', '2M00000068+5710233 '])
+        param = np.random.normal(size=(2, 3))
+        table = fits.BinTableHDU.from_columns([fits.Column(name='APOGEE_ID', format='19A', array=apogee_id),
+                                               fits.Column(name='PARAM', format='3E', array=param)])
+        with tempfile.TemporaryDirectory() as folder:
+            fits_path = os.path.join(folder, 'allStar.fits')
+            table.writeto(fits_path)
+            catalog = CatalogCache(fits_path)
+            self.assertEqual(catalog.names, ['APOGEE_ID', 'PARAM'])
+            self.assertEqual(len(catalog), 2)
+            # FITS padding is stripped and strings are compared like astropy does
+            self.assertEqual(np.nonzero(catalog['APOGEE_ID'] == '2M00000068+5710233')[0][0], 1)
+            npt.assert_array_almost_equal(catalog['PARAM'], param, decimal=5)
+            # second read is from the memory-mapped cache of the same file
+            npt.assert_array_equal(CatalogCache(fits_path)['PARAM'], catalog['PARAM'])
+
+    def test_generator_batch(self):
+        import pickle
+        import numpy as np
+        from astroNN.nn.utilities.generator import GeneratorMaster
+
+        data = np.random.normal(size=(100, 10)).astype(np.float32)
+        generator = GeneratorMaster(batch_size=8, shuffle=True, steps_per_epoch=12, data=[data], manual_reset=False)
+        generator.num_buffers = 2
+        idx = np.random.permutation(100)
+        x1 = generator.input_d_checking(data, idx[:8])
+        # dtype is kept and channel axis is added
+        self.assertEqual(x1.dtype, np.float32)
+        npt.assert_array_equal(x1[:, :, 0], data[idx[:8]])
+        x2 = generator.input_d_checking(data, idx[8:16])
+        # buffers are reused after num_buffers batches
+        self.assertFalse(np.shares_memory(x1, x2))
+        self.assertTrue(np.shares_memory(x1, generator.input_d_checking(data, idx[16:24])))
+
+        # permutation of every epoch is the same in every copy of the generator, e.g. in worker processes
+        old_idx_list = generator.idx_list
+        generator.on_epoch_end()
+        self.assertFalse(np.array_equal(old_idx_list, generator.idx_list))
+        npt.assert_array_equal(pickle.loads(pickle.dumps(generator)).idx_list, generator.idx_list)
+
+    def test_block_sampler(self):
+        import numpy as np
+        from astroNN.nn.utilities.generator import GeneratorMaster
+
+        data = np.zeros((1000, 3), dtype=np.float32)
+        indices = np.random.permutation(1000)[:900]
+        generator = GeneratorMaster(batch_size=10, shuffle=True, steps_per_epoch=90, data=[data], manual_reset=False,
+                                    indices=indices, sampler='block', block_size=50, buffer_blocks=2)
+        # every row is visited once
+        npt.assert_array_equal(np.sort(generator.idx_list), np.sort(indices))
+        # every 100 rows come from 2 blocks of 50 contiguous rows
+        blocks = np.searchsorted(np.sort(indices), generator.idx_list) // 50
+        self.assertTrue(all(len(np.unique(buffer)) == 2 for buffer in blocks.reshape(9, 100)))
+        self.assertRaises(ValueError, GeneratorMaster, batch_size=10, shuffle=True, steps_per_epoch=90, data=[data],
+                          manual_reset=False, sampler='blocks')
+
+    def test_augmentation(self):
+        import numpy as np
+        from astroNN.config import MAGIC_NUMBER
+        from astroNN.nn.utilities.augmentation import ImageFlipRotate, SpectraMask, SpectraNoise
+        from astroNN.nn.utilities.generator import GeneratorMaster
+
+        spectra = np.random.normal(size=(100, 50, 1)).astype(np.float32)
+        spectra[:, 0] = MAGIC_NUMBER
+        generator = GeneratorMaster(batch_size=10, shuffle=True, steps_per_epoch=10, data=[spectra],
+                                    manual_reset=False)
+        generator.augment = [SpectraNoise(), SpectraMask(fraction=0.1)]
+        idx = generator.idx_list[:10]
+        x = generator.augment_inputs(spectra[idx], idx, x_err=np.ones_like(spectra[idx]))
+        self.assertEqual(x.dtype, np.float32)
+        # magic number is kept and some pixels are masked
+        self.assertTrue(np.all(x[:, 0] == MAGIC_NUMBER))
+        self.assertTrue(np.any(x[:, 1:] == MAGIC_NUMBER))
+        # same batch in the same epoch is augmented in the same way
+        npt.assert_array_equal(generator.augment_inputs(spectra[idx], idx, x_err=np.ones_like(spectra[idx])), x)
+
+        images = np.random.normal(size=(64, 5, 5, 3))
+        flipped = ImageFlipRotate()(images.copy(), np.random.default_rng(0))
+        for image, flipped_image in zip(images, flipped):
+            symmetries = [np.rot90(i, k) for i in [image, image[:, ::-1]] for k in range(4)]
+            self.assertTrue(any(np.array_equal(flipped_image, i) for i in symmetries))
+
+    def test_shared_array(self):
+        import pickle
+        import numpy as np
+        from astroNN.nn.utilities.generator import SharedArray
+
+        data = np.random.normal(size=(1000, 50)).astype(np.float32)
+        shared = SharedArray(data)
+        pickled = pickle.dumps(shared)
+        # only the name is pickled, not the data
+        self.assertLess(len(pickled), data.nbytes // 100)
+        attached = pickle.loads(pickled)
+        npt.assert_array_equal(attached[[5, 2]], data[[5, 2]])
+        self.assertEqual(attached.shape, data.shape)
+        del attached
+
     def test_patching(self):
         import astroNN.data
         from astroNN.shared.patch_util import Patch